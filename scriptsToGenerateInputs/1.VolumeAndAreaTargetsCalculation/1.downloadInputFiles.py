@@ -1,37 +1,105 @@
-import urllib.request
+import http.client
+import io
+import shutil
+import threading
+import urllib.error
+import urllib.parse
 import zipfile
+import re
 import os
 import sys
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def download_file(url, destination):
-    """Download a file from URL to destination if it doesn't already exist."""
-    if destination.exists():
-        print(f"File already exists, skipping: {destination.name}")
-        return False
+# Maximum number of simultaneous downloads
+MAX_PARALLEL_DOWNLOADS = 8
+# Size of the chunks written to disk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# HTTP(S) connections kept alive by each download thread, one per host.
+# Reusing them avoids a new TCP + TLS handshake for each of the ~30 files that come from the same server.
+_thread_connections = threading.local()
+
+def open_url(url, method="GET", headers=None, max_redirects=5):
+    """Send a request on the kept-alive connection of the current thread to the host of url, following redirections.
+    Returns the http.client.HTTPResponse, which must be read entirely so that the connection can be reused."""
+    parts = urllib.parse.urlsplit(url)
+    connections = _thread_connections.__dict__.setdefault("by_host", {})
+    connection = connections.get((parts.scheme, parts.netloc))
+    if connection is None:
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        connection = connection_class(parts.netloc, timeout=60)
+        connections[(parts.scheme, parts.netloc)] = connection
+
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    try:
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+    except (http.client.HTTPException, ConnectionError):
+        # The server has closed the kept-alive connection in the meantime; we reconnect once
+        connection.close()
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+
+    if response.status in (301, 302, 303, 307, 308) and max_redirects > 0:
+        response.read()
+        redirected_url = urllib.parse.urljoin(url, response.getheader("Location"))
+        return open_url(redirected_url, method, headers, max_redirects - 1)
+    if response.status >= 400:
+        response.read()
+        raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+    return response
 
-    print(f"Downloading: {url}")
-    urllib.request.urlretrieve(url, destination)
+def download_file(url, destination):
+    """Download a file from URL to destination if it doesn't already exist.
+    A file left incomplete by an interrupted download is resumed where it stopped."""
+    local_size = destination.stat().st_size if destination.exists() else 0
+    if local_size:
+        # Compare the size of the local file with the one announced by the server
+        with open_url(url, method="HEAD") as response:
+            response.read()
+            remote_size = response.getheader("Content-Length")
+        if remote_size is None or local_size >= int(remote_size):
+            print(f"File already exists, skipping: {destination.name}")
+            return False
+        print(f"Resuming: {url} (from byte {local_size} of {remote_size})")
+    else:
+        print(f"Downloading: {url}")
+
+    headers = {"Range": f"bytes={local_size}-"} if local_size else None
+    with open_url(url, headers=headers) as response:
+        # A server that ignores the range answers 200 with the whole file instead of 206
+        mode = 'ab' if response.status == 206 else 'wb'
+        with open(destination, mode) as f:
+            shutil.copyfileobj(response, f, DOWNLOAD_CHUNK_SIZE)
     print(f"Saved to: {destination}")
     return True
 
 def extract_filtered_zip(zip_path, extract_to, include_string, exclude_strings):
-    """Extract only files containing include_string and not containing any exclude_strings from zip."""
+    """Extract only files containing include_string and not containing any exclude_strings from zip.
+    zip_path can also be a file-like object, such as an archive downloaded in memory."""
     print(f"Extracting files containing '{include_string}'...")
+    # A single compiled alternation tests all of the exclude strings at once, in C
+    exclude_pattern = re.compile("|".join(map(re.escape, exclude_strings))) if exclude_strings else None
+
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        filtered_files = []
-        for f in zip_ref.namelist():
-            if include_string in f and not any(excl in f for excl in exclude_strings):
-                filtered_files.append(f)
-
-        for file in filtered_files:
-            file_path = extract_to / file
-            if file_path.exists():
-                print(f"  Already exists, skipping: {file}")
+        # Single pass over the central directory to select the members to extract
+        filtered_files = [info for info in zip_ref.infolist()
+                          if include_string in info.filename
+                          and (exclude_pattern is None or not exclude_pattern.search(info.filename))]
+
+        to_extract = []
+        for info in filtered_files:
+            if (extract_to / info.filename).exists():
+                print(f"  Already exists, skipping: {info.filename}")
             else:
-                zip_ref.extract(file, extract_to)
-                print(f"  Extracted: {file}")
+                to_extract.append(info)
+
+        # All remaining members are extracted in one call, with the path sanitizing of zipfile
+        zip_ref.extractall(extract_to, members=to_extract)
+        for info in to_extract:
+            print(f"  Extracted: {info.filename}")
     print(f"Extraction complete.")
 
 def main():
@@ -51,38 +119,34 @@ def main():
     # The URL used here is not the URL that can be found on the website; it's a special URL to access it by script.
     # See https://github.com/nvkelso/natural-earth-vector/issues/246#issuecomment-1134290221
     ne_zip_url = "https://naciscdn.org/naturalearth/5.1.2/50m/cultural/50m_cultural.zip"
-    ne_zip_path = input_data_dir / "50m_cultural.zip"
 
-    downloaded = download_file(ne_zip_url, ne_zip_path)
+    # The archive is small enough to be kept in memory : only the extracted shapefile touches the disk
+    print(f"Downloading: {ne_zip_url}")
+    with open_url(ne_zip_url) as response:
+        ne_zip_data = io.BytesIO(response.read())
 
-    if downloaded or ne_zip_path.exists():
-        extract_filtered_zip(
-            ne_zip_path, 
-            input_data_dir, 
-            "ne_50m_admin_1_states_provinces",
-            ["lakes", "lines", "rank"]
-        )
+    extract_filtered_zip(
+        ne_zip_data, 
+        input_data_dir, 
+        "ne_50m_admin_1_states_provinces",
+        ["lakes", "lines", "rank"]
+    )
 
-        # Delete the zip file
-        ne_zip_path.unlink()
-        print(f"Deleted: {ne_zip_path}")
+    # Steps 2 to 4 are independent downloads : we list them all, and then download them concurrently
+    downloads = []
 
-    # Step 2: Download CANLAD raster files
-    print("\n=== Step 2: Downloading CANLAD raster files ===")
+    # Step 2: CANLAD raster files
+    print("\n=== Step 2: Listing CANLAD raster files ===")
     canlad_base_url = "https://ftp.maps.canada.ca/pub/nrcan_rncan/Forests_Foret/canlad_including_insect_defoliation/v1/Disturbances_Time_Series/"
 
     for year in range(2000, 2025):
         filename = f"canlad_annual_{year}_v1.tif"
         url = canlad_base_url + filename
         destination = rasters_dir / filename
+        downloads.append((url, destination))
 
-        try:
-            download_file(url, destination)
-        except Exception as e:
-            print(f"Error downloading {filename}: {e}")
-
-    # Step 3: Download NFI species group rasters
-    print("\n=== Step 3: Downloading NFI species group rasters ===")
+    # Step 3: NFI species group rasters
+    print("\n=== Step 3: Listing NFI species group rasters ===")
 
     # Define the files to download
     nfi_files = {
@@ -110,14 +174,10 @@ def main():
         for filename in files:
             url = base_url + filename
             destination = rasters_dir / filename
+            downloads.append((url, destination))
 
-            try:
-                download_file(url, destination)
-            except Exception as e:
-                print(f"Error downloading {filename}: {e}")
-
-    # Step 4: Download National Forestry Database CSV files
-    print("\n=== Step 4: Downloading National Forestry Database CSV files ===")
+    # Step 4: National Forestry Database CSV files
+    print("\n=== Step 4: Listing National Forestry Database CSV files ===")
     
     # See http://nfdp.ccfm.org/en/download.php for more info on these CSV file and their content
 
@@ -132,10 +192,18 @@ def main():
 
     for url, filename in nfd_files:
         destination = nfd_dir / filename
-        try:
-            download_file(url, destination)
-        except Exception as e:
-            print(f"Error downloading {filename}: {e}")
+        downloads.append((url, destination))
+
+    # The downloads are blocking socket reads, during which the GIL is released : threads overlap them well.
+    # Each thread keeps its connections alive, and a failed download doesn't cancel the others.
+    print(f"\n=== Downloading {len(downloads)} files concurrently ===")
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS) as executor:
+        futures = {executor.submit(download_file, url, destination): destination for url, destination in downloads}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error downloading {futures[future].name}: {e}")
 
     print("\n=== Setup Complete ===")
     print(f"Data downloaded to: {input_data_dir}")
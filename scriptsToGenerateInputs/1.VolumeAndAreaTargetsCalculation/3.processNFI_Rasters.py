@@ -1,9 +1,17 @@
 import rasterio
-from rasterio.mask import mask
+from rasterio.mask import raster_geometry_mask
+from rasterio.windows import Window
 import numpy as np
 import geopandas as gpd
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 
+# Size (in pixels) of the square tiles in which the NFI rasters are processed and written
+TILE_SIZE = 512
+# Converts the percentages of the NFI species groups rasters to fractions
+PERCENT_TO_FRACTION = np.float32(0.01)
+
 def get_province_from_landscape(provinces_shapefile='ne_50m_admin_1_states_provinces.shp', 
                                  landscape_shapefile='study_landscape.shp'):
     """
@@ -27,16 +35,22 @@ def get_province_from_landscape(provinces_shapefile='ne_50m_admin_1_states_provi
         If landscape intersects multiple provinces, US states, or no provinces
     """
 
-    # Read shapefiles
-    provinces = gpd.read_file(provinces_shapefile)
-    landscape = gpd.read_file(landscape_shapefile)
+    # Read shapefiles (only the attributes of the provinces/states used below are read).
+    # pyogrio reads the whole layer in one vectorized call, instead of feature by feature with fiona
+    provinces = gpd.read_file(provinces_shapefile, engine='pyogrio', columns=['adm0_a3', 'name'])
+    landscape = gpd.read_file(landscape_shapefile, engine='pyogrio')
 
     # Ensure same CRS
     if provinces.crs != landscape.crs:
         landscape = landscape.to_crs(provinces.crs)
 
+    # Keep only the provinces/states whose bounding box overlaps the one of the landscape,
+    # so that the spatial join is done against a handful of polygons instead of all of them
+    minx, miny, maxx, maxy = landscape.total_bounds
+    candidate_provinces = provinces.cx[minx:maxx, miny:maxy]
+
     # Spatial join to find intersecting provinces/states
-    intersecting = gpd.sjoin(provinces, landscape, how='inner', predicate='intersects')
+    intersecting = gpd.sjoin(candidate_provinces, landscape, how='inner', predicate='intersects')
 
     # Check if any intersection exists
     if len(intersecting) == 0:
@@ -61,6 +75,54 @@ def get_province_from_landscape(provinces_shapefile='ne_50m_admin_1_states_provi
     # Return the single province as a GeoDataFrame
     return canadian_provinces.iloc[[0]].reset_index(drop=True)
 
+def estimate_volumes(nfi_tiles, conifer_out=None, deciduous_out=None):
+    """
+    Estimates the conifer and deciduous merchantable volumes of a tile from the 2001 NFI rasters,
+    using the 2011 rasters where more than 20% of the species of 2001 are unknown.
+
+    Parameters:
+    -----------
+    nfi_tiles : dict
+        Arrays of the tile for each year (2001, 2011) and each raster ('volume', 'broadleaf', 'needleleaf', 'unknown')
+    conifer_out, deciduous_out : np.ndarray, optional
+        float32 buffers with the shape of the tile in which the volumes are written (allocated if not given)
+
+    Returns:
+    --------
+    tuple
+        (conifer_vol, deciduous_vol) arrays of the tile
+    """
+    volume_2001 = nfi_tiles[2001]['volume']
+    broadleaf_pct_2001 = nfi_tiles[2001]['broadleaf']
+    needleleaf_pct_2001 = nfi_tiles[2001]['needleleaf']
+    unknown_pct_2001 = nfi_tiles[2001]['unknown']
+    volume_2011 = nfi_tiles[2011]['volume']
+    broadleaf_pct_2011 = nfi_tiles[2011]['broadleaf']
+    needleleaf_pct_2011 = nfi_tiles[2011]['needleleaf']
+    unknown_pct_2011 = nfi_tiles[2011]['unknown']
+
+    # Handle unknown species : 2011 values are used where 2001 has >20% unknown,
+    # and volumes are left to 0 where both years have >20% unknown
+    mask_unknown_2001 = unknown_pct_2001 > 20
+    use_2001 = ~mask_unknown_2001
+    use_2011 = mask_unknown_2001 & (unknown_pct_2011 <= 20)
+
+    # Calculate estimated volumes directly into the outputs, reading each year only where it is used
+    # (in float32 and with a multiplication by 0.01, to avoid the float64 temporaries of a division by 100.0)
+    deciduous_vol = np.zeros(volume_2001.shape, dtype=np.float32) if deciduous_out is None else deciduous_out
+    deciduous_vol.fill(0)
+    np.multiply(volume_2001, broadleaf_pct_2001, out=deciduous_vol, where=use_2001, dtype=np.float32)
+    np.multiply(volume_2011, broadleaf_pct_2011, out=deciduous_vol, where=use_2011, dtype=np.float32)
+    deciduous_vol *= PERCENT_TO_FRACTION
+
+    conifer_vol = np.zeros(volume_2001.shape, dtype=np.float32) if conifer_out is None else conifer_out
+    conifer_vol.fill(0)
+    np.multiply(volume_2001, needleleaf_pct_2001, out=conifer_vol, where=use_2001, dtype=np.float32)
+    np.multiply(volume_2011, needleleaf_pct_2011, out=conifer_vol, where=use_2011, dtype=np.float32)
+    conifer_vol *= PERCENT_TO_FRACTION
+
+    return conifer_vol, deciduous_vol
+
 def process_nfi_rasters():
     print("Starting NFI raster processing...")
 
@@ -70,20 +132,6 @@ def process_nfi_rasters():
     canadianProvince = get_province_from_landscape(provinces_shapefile='./InputData/ne_50m_admin_1_states_provinces.shp', 
                                  landscape_shapefile='./InputData/study_landscape.shp')
 
-    # Load a reference raster to get CRS
-    print("Getting CRS from NFI raster...")
-    ref_raster_path = base_path / "NFI_MODIS250m_2001_kNN_Structure_Volume_Merch_v1.tif"
-    with rasterio.open(ref_raster_path) as src:
-        raster_crs = src.crs
-
-    print(f"Raster CRS: {raster_crs}")
-    print(f"Canadian Province shapefile CRS: {canadianProvince.crs}")
-
-    # Reproject Canadian Province shapefile if needed
-    if canadianProvince.crs != raster_crs:
-        print(f"Reprojecting Canadian Province shapefile from {canadianProvince.crs} to {raster_crs}...")
-        canadianProvince = canadianProvince.to_crs(raster_crs)
-
     # NFI raster paths
     nfi_files = {
         2001: {
@@ -99,116 +147,96 @@ def process_nfi_rasters():
             'unknown': base_path / "NFI_MODIS250m_2011_kNN_SpeciesGroups_Unknown_Spp_v1.tif"
         }
     }
-
-    # Load 2001 rasters
-    print("Loading 2001 NFI rasters...")
-    with rasterio.open(nfi_files[2001]['volume']) as src:
-        volume_2001 = src.read(1)
-        profile = src.profile
-
-    with rasterio.open(nfi_files[2001]['broadleaf']) as src:
-        broadleaf_pct_2001 = src.read(1)
-
-    with rasterio.open(nfi_files[2001]['needleleaf']) as src:
-        needleleaf_pct_2001 = src.read(1)
-
-    with rasterio.open(nfi_files[2001]['unknown']) as src:
-        unknown_pct_2001 = src.read(1)
-
-    # Load 2011 rasters
-    print("Loading 2011 NFI rasters...")
-    with rasterio.open(nfi_files[2011]['volume']) as src:
-        volume_2011 = src.read(1)
-
-    with rasterio.open(nfi_files[2011]['broadleaf']) as src:
-        broadleaf_pct_2011 = src.read(1)
-
-    with rasterio.open(nfi_files[2011]['needleleaf']) as src:
-        needleleaf_pct_2011 = src.read(1)
-
-    with rasterio.open(nfi_files[2011]['unknown']) as src:
-        unknown_pct_2011 = src.read(1)
-
-    # Calculate estimated volumes
-    print("Calculating estimated volumes for 2001...")
-    deciduous_vol_2001 = volume_2001 * (broadleaf_pct_2001 / 100.0)
-    conifer_vol_2001 = volume_2001 * (needleleaf_pct_2001 / 100.0)
-
-    print("Calculating estimated volumes for 2011...")
-    deciduous_vol_2011 = volume_2011 * (broadleaf_pct_2011 / 100.0)
-    conifer_vol_2011 = volume_2011 * (needleleaf_pct_2011 / 100.0)
-
-    # Handle unknown species
-    print("Handling unknown species pixels...")
-    mask_unknown_2001 = unknown_pct_2001 > 20
-    mask_unknown_2011 = unknown_pct_2011 > 20
-
-    # Replace 2001 values with 2011 where 2001 has >20% unknown
-    deciduous_vol_2001[mask_unknown_2001] = deciduous_vol_2011[mask_unknown_2001]
-    conifer_vol_2001[mask_unknown_2001] = conifer_vol_2011[mask_unknown_2001]
-
-    # Set to 0 where both years have >20% unknown
-    mask_both_unknown = mask_unknown_2001 & mask_unknown_2011
-    deciduous_vol_2001[mask_both_unknown] = 0
-    conifer_vol_2001[mask_both_unknown] = 0
-
-    # Crop to Canadian Province extent
-    print("Cropping to Canadian Province extent...")
-    canadianProvince_geom = [canadianProvince.geometry.unary_union.__geo_interface__]
-
-    # Mask and save conifer
-    print("Saving temporary conifer volume raster...")
-    with rasterio.open(nfi_files[2001]['volume']) as src:
-        out_conifer, out_transform = mask(src, canadianProvince_geom, crop=True, all_touched=True)
-        out_meta = src.meta.copy()
+    conifer_temp_path = base_path / "temp_conifer_volume_2001.tif"
+    deciduous_temp_path = base_path / "temp_deciduous_volume_2001.tif"
+
+    # Each NFI raster is opened only once; the 2001 volume raster is used as the reference
+    # for the CRS, the crop to the Canadian Province and the output profile
+    with ExitStack() as stack:
+        # Lets GDAL decode the compressed NFI rasters with all of the CPUs, and keep up to 1 GB
+        # of decoded blocks in cache so that no block is decoded twice
+        stack.enter_context(rasterio.Env(GDAL_NUM_THREADS='ALL_CPUS', GDAL_CACHEMAX=1024))
+        nfi_sources = {year: {name: stack.enter_context(rasterio.open(path)) for name, path in year_files.items()}
+                       for year, year_files in nfi_files.items()}
+        ref_src = nfi_sources[2001]['volume']
+        raster_crs = ref_src.crs
+
+        print(f"Raster CRS: {raster_crs}")
+        print(f"Canadian Province shapefile CRS: {canadianProvince.crs}")
+
+        # Reproject Canadian Province shapefile if needed
+        if canadianProvince.crs != raster_crs:
+            print(f"Reprojecting Canadian Province shapefile from {canadianProvince.crs} to {raster_crs}...")
+            canadianProvince = canadianProvince.to_crs(raster_crs)
+
+        # Compute the crop to the Canadian Province first, so that only the window of the
+        # province is read from the eight NFI rasters (they all share the same grid).
+        # raster_geometry_mask only rasterizes the province : no pixel of the rasters is read for this.
+        print("Cropping to Canadian Province extent...")
+        # canadianProvince has a single row, so its geometries can be given as they are,
+        # without a union nor a conversion to a GeoJSON-like dict
+        canadianProvince_geom = list(canadianProvince.geometry.values)
+        outside_province, out_transform, province_window = raster_geometry_mask(
+            ref_src, canadianProvince_geom, crop=True, all_touched=True)
+        out_meta = ref_src.meta.copy()
         out_meta.update({
-            "height": out_conifer.shape[1],
-            "width": out_conifer.shape[2],
+            "height": outside_province.shape[0],
+            "width": outside_province.shape[1],
             "transform": out_transform,
             "nodata": 0,
-            "dtype": 'float32'
+            "dtype": 'float32',
+            "tiled": True,
+            "blockxsize": TILE_SIZE,
+            "blockysize": TILE_SIZE,
+            # ZSTD with the floating point predictor shrinks these smooth float32 rasters several times
+            # at almost no writing cost, which reduces the disk I/O of 4.analyzeAnnualHarvest.py
+            "compress": 'zstd',
+            "zstd_level": 3,
+            "predictor": 3,
+            "num_threads": 'ALL_CPUS'
         })
 
-        # Get mask indices
-        mask_array = out_conifer[0] != src.nodata
-
-        # Create output array
-        conifer_output = np.zeros((out_conifer.shape[1], out_conifer.shape[2]), dtype=np.float32)
-
-        # Map full array to cropped array
-        with rasterio.open(nfi_files[2001]['volume']) as src_full:
-            window = src_full.window(*canadianProvince.total_bounds)
-            row_off = int(window.row_off)
-            col_off = int(window.col_off)
-            height = out_conifer.shape[1]
-            width = out_conifer.shape[2]
-
-            conifer_subset = conifer_vol_2001[row_off:row_off+height, col_off:col_off+width]
-            conifer_output = np.where(mask_array, conifer_subset, 0)
-
-        conifer_temp_path = base_path / "temp_conifer_volume_2001.tif"
-        with rasterio.open(conifer_temp_path, 'w', **out_meta) as dst:
-            dst.write(conifer_output.astype('float32'), 1)
+        # The province window is processed tile by tile : each tile goes through the whole computation
+        # while it is still in the CPU cache, and the rasters of the full province are never held in memory
+        print("Calculating estimated conifer and deciduous volumes tile by tile...")
+        conifer_dst = stack.enter_context(rasterio.open(conifer_temp_path, 'w', **out_meta))
+        deciduous_dst = stack.enter_context(rasterio.open(deciduous_temp_path, 'w', **out_meta))
+
+        # The eight tiles are read concurrently : each read is independent, and GDAL releases the GIL
+        # while decoding. Each dataset is only ever used by one thread at a time.
+        nfi_keys = [(year, name) for year, year_sources in nfi_sources.items() for name in year_sources]
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=len(nfi_keys)))
+
+        # The two output buffers are allocated once and reused for every tile (through a view of
+        # the right size for the smaller tiles on the right and bottom edges of the province)
+        conifer_buffer = np.empty((TILE_SIZE, TILE_SIZE), dtype=np.float32)
+        deciduous_buffer = np.empty((TILE_SIZE, TILE_SIZE), dtype=np.float32)
+
+        for _, tile_window in conifer_dst.block_windows(1):
+            # Same tile in the grid of the full NFI rasters
+            source_window = Window(province_window.col_off + tile_window.col_off,
+                                   province_window.row_off + tile_window.row_off,
+                                   tile_window.width, tile_window.height)
+            tile_arrays = executor.map(lambda key: nfi_sources[key[0]][key[1]].read(1, window=source_window), nfi_keys)
+            nfi_tiles = {year: {} for year in nfi_sources}
+            for (year, name), tile_array in zip(nfi_keys, tile_arrays):
+                nfi_tiles[year][name] = tile_array
+
+            conifer_vol, deciduous_vol = estimate_volumes(
+                nfi_tiles,
+                conifer_out=conifer_buffer[:tile_window.height, :tile_window.width],
+                deciduous_out=deciduous_buffer[:tile_window.height, :tile_window.width])
+
+            # Mask to the Canadian Province and to the valid pixels of the 2001 volume raster, in place
+            province_tile = ~outside_province[tile_window.toslices()]
+            if ref_src.nodata is not None:
+                province_tile &= nfi_tiles[2001]['volume'] != ref_src.nodata
+            np.multiply(conifer_vol, province_tile, out=conifer_vol)
+            np.multiply(deciduous_vol, province_tile, out=deciduous_vol)
+            conifer_dst.write(conifer_vol, 1, window=tile_window)
+            deciduous_dst.write(deciduous_vol, 1, window=tile_window)
 
     print(f"Saved: {conifer_temp_path}")
-
-    # Mask and save deciduous
-    print("Saving temporary deciduous volume raster...")
-    with rasterio.open(nfi_files[2001]['volume']) as src:
-        with rasterio.open(nfi_files[2001]['volume']) as src_full:
-            window = src_full.window(*canadianProvince.total_bounds)
-            row_off = int(window.row_off)
-            col_off = int(window.col_off)
-            height = out_conifer.shape[1]
-            width = out_conifer.shape[2]
-
-            deciduous_subset = deciduous_vol_2001[row_off:row_off+height, col_off:col_off+width]
-            deciduous_output = np.where(mask_array, deciduous_subset, 0)
-
-        deciduous_temp_path = base_path / "temp_deciduous_volume_2001.tif"
-        with rasterio.open(deciduous_temp_path, 'w', **out_meta) as dst:
-            dst.write(deciduous_output.astype('float32'), 1)
-
     print(f"Saved: {deciduous_temp_path}")
     print("NFI raster processing complete!")
 
@@ -1,5 +1,6 @@
 import rasterio
-from rasterio.mask import mask
+from rasterio.mask import raster_geometry_mask
+from rasterio.features import geometry_mask
 from rasterio.warp import reproject, Resampling
 from rasterio.windows import Window
 import numpy as np
@@ -7,10 +8,30 @@ import pandas as pd
 import geopandas as gpd
 from pathlib import Path
 from osgeo import gdal, gdalconst, osr
-import tempfile
 import os
 import re
 import json
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of rows of the 250m rasters summed at once by sum_harvested_volumes
+SUM_BLOCK_ROWS = 64
+# Number of rows of the 30m CanLad rasters read and reclassified at once by process_year
+CANLAD_BLOCK_ROWS = 1024
+# Number of years processed at the same time, set with the MHS_CBAU_PARALLEL_YEARS environment variable (1 by default).
+# Each worker process holds the 30m CanLad mask of the province for its year, its resampled fractions and its own
+# copy of the NFI volume rasters : this is limited by memory rather than by the number of CPUs, and each additional
+# year needs about as much memory as a single year (see the job script).
+MAX_PARALLEL_YEARS = max(1, int(os.environ.get("MHS_CBAU_PARALLEL_YEARS", "1")))
+
+# Set the MHS_CBAU_DEBUG_RESAMPLE environment variable (e.g. to 1) to save the CanLad harvests
+# resampled to 250m of each year in ./InputData/Rasters/resampled_debug, for debugging
+DEBUG_RESAMPLE = bool(os.environ.get("MHS_CBAU_DEBUG_RESAMPLE"))
+
+# Data shared by all of the years, set once in each worker process by init_year_worker
+_year_worker_data = {}
+# Province geometry reprojected to the CRS of the CanLad rasters, cached by get_province_geom
+_province_geom_by_crs = {}
 
 def get_province_from_landscape(provinces_shapefile='./InputData/ne_50m_admin_1_states_provinces.shp', 
                                  landscape_shapefile='./InputData/study_landscape.shp'):
@@ -37,15 +58,17 @@ def get_province_from_landscape(provinces_shapefile='./InputData/ne_50m_admin_1_
     """
 
     # Read shapefiles
-    provinces = gpd.read_file(provinces_shapefile)
-    landscape = gpd.read_file(landscape_shapefile)
+    provinces = gpd.read_file(provinces_shapefile, engine='pyogrio')
+    landscape = gpd.read_file(landscape_shapefile, engine='pyogrio')
 
     # Ensure same CRS
     if provinces.crs != landscape.crs:
         landscape = landscape.to_crs(provinces.crs)
 
-    # Spatial join to find intersecting provinces/states
-    intersecting = gpd.sjoin(provinces, landscape, how='inner', predicate='intersects')
+    # Find the intersecting provinces/states with the spatial index of the provinces : the bounding
+    # boxes are tested first, and the exact predicate only on the candidates (no joined DataFrame is built)
+    intersecting_idx = provinces.sindex.query(landscape.geometry.union_all(), predicate='intersects')
+    intersecting = provinces.iloc[intersecting_idx]
 
     # Check if any intersection exists
     if len(intersecting) == 0:
@@ -73,52 +96,84 @@ def get_province_from_landscape(provinces_shapefile='./InputData/ne_50m_admin_1_
 
     return (province_name, province_gdf)
 
-def get_thinning_areas(year, province):
+def read_nfd_csv(csv_path, categorical_columns):
     """
-    Extract commercial and precommercial thinning areas for a given year and province.
+    Read a CSV file of the National Forestry Database with the multithreaded pyarrow parser.
+
+    Parameters:
+    csv_path (str): Path to the CSV file
+    categorical_columns (list): Text columns used in filters, converted to categories so that
+                                comparisons are done on integer codes instead of strings
+
+    Returns:
+    pd.DataFrame: Content of the CSV file
+    """
+    # Had to precise encoding as it's not UTF-8
+    df = pd.read_csv(csv_path, encoding='ISO-8859-1', engine='pyarrow')
+    return df.astype({column: 'category' for column in categorical_columns})
+
+@lru_cache(maxsize=None)
+def load_thinning_areas_by_year(province):
+    """
+    Read the NFD thinning CSV files once, and sum the commercial and precommercial thinning areas
+    of a province for each year.
 
     Parameters:
-    year (int): The year to query
     province (str): The province name (English)
 
     Returns:
-    tuple: (commercial_thinning_ha, precommercial_thinning_ha)
+    tuple: (commercial_thinning_by_year, precommercial_thinning_by_year), dicts of areas in hectares keyed by year
     """
     # Read CSV files
-    # Had to precise encoding as it's not UTF-8
     # WARNING : Area in these files are in hectares !
-    harvesting_df = pd.read_csv("./InputData/NationalForestryDatabase/NFD_Area_harvested_by_ownership_and_harvesting_method.csv", encoding='ISO-8859-1')
-    tending_df = pd.read_csv("./InputData/NationalForestryDatabase/NFD_Area_of_stand_tending_by_ownership_treatment.csv", encoding='ISO-8859-1')
+    harvesting_df = read_nfd_csv("./InputData/NationalForestryDatabase/NFD_Area_harvested_by_ownership_and_harvesting_method.csv",
+                                 ['Jurisdiction', 'Harvesting method'])
+    tending_df = read_nfd_csv("./InputData/NationalForestryDatabase/NFD_Area_of_stand_tending_by_ownership_treatment.csv",
+                              ['Jurisdiction', 'Method'])
 
     # Filter commercial thinning from harvesting data
     commercial_mask = (
-        (harvesting_df['Year'] == year) &
         (harvesting_df['Jurisdiction'] == province) &
         (harvesting_df['Harvesting method'] == 'Commercial thinning')
     )
-    commercial_thinning = harvesting_df[commercial_mask]['Area (hectares)'].sum()
+    commercial_thinning = harvesting_df[commercial_mask].groupby('Year')['Area (hectares)'].sum().to_dict()
 
     # Filter precommercial thinning from tending data
     precommercial_mask = (
-        (tending_df['Year'] == year) &
         (tending_df['Jurisdiction'] == province) &
         (tending_df['Method'] == 'Precommercial thinning')
     )
-    precommercial_thinning = tending_df[precommercial_mask]['Area (hectares)'].sum()
+    precommercial_thinning = tending_df[precommercial_mask].groupby('Year')['Area (hectares)'].sum().to_dict()
 
     return (commercial_thinning, precommercial_thinning)
 
+def get_thinning_areas(year, province):
+    """
+    Extract commercial and precommercial thinning areas for a given year and province.
+    The CSV files are only read and aggregated on the first call (see load_thinning_areas_by_year).
+
+    Parameters:
+    year (int): The year to query
+    province (str): The province name (English)
+
+    Returns:
+    tuple: (commercial_thinning_ha, precommercial_thinning_ha)
+    """
+    commercial_thinning, precommercial_thinning = load_thinning_areas_by_year(province)
+
+    return (commercial_thinning.get(year, 0), precommercial_thinning.get(year, 0))
+
 
 def load_harvest_data(provinceName):
     print("Loading harvest data CSV...")
     csv_path = "./InputData/NationalForestryDatabase/NFD_Net_Merchantable_Volume_of_Roundwood_Harvested.csv"
-    df = pd.read_csv(csv_path, encoding='ISO-8859-1')
+    df = read_nfd_csv(csv_path, ['Jurisdiction', 'Species group'])
 
     # Filter for provinceName
     quebec_data = df[df['Jurisdiction'] == provinceName].copy()
 
     # Group by year and species, summing volumes
-    harvest_by_year = quebec_data.groupby(['Year', 'Species group'])['Volume (cubic metres) (En)'].sum().reset_index()
+    harvest_by_year = quebec_data.groupby(['Year', 'Species group'], observed=True)['Volume (cubic metres) (En)'].sum().reset_index()
     
     # print(harvest_by_year)
 
@@ -126,42 +181,32 @@ def load_harvest_data(provinceName):
     print(f"Years range: {harvest_by_year['Year'].min()} to {harvest_by_year['Year'].max()}")
     print(f"Species groups: {harvest_by_year['Species group'].unique()}")
 
-    # Check unspecified volumes
+    # Check unspecified volumes, for all of the years at once on a table with one column per species group
     print("\nChecking unspecified volumes...")
-    for year in sorted(harvest_by_year['Year'].unique()):
-        year_data = harvest_by_year[harvest_by_year['Year'] == year]
-        
-        # print(year_data)
+    volumes_by_year = harvest_by_year.pivot(index='Year', columns='Species group', values='Volume (cubic metres) (En)')
+    volumes_by_year.columns = volumes_by_year.columns.astype(str)
+    volumes_by_year = volumes_by_year.reindex(columns=['Hardwoods', 'Softwoods', 'Unspecified']).fillna(0)
 
-        hardwood_rows = year_data[year_data['Species group'] == 'Hardwoods']
-        softwood_rows = year_data[year_data['Species group'] == 'Softwoods']
-        unspecified_rows = year_data[year_data['Species group'] == 'Unspecified']
+    hardwood = volumes_by_year['Hardwoods']
+    softwood = volumes_by_year['Softwoods']
+    unspecified = volumes_by_year['Unspecified']
+    over_threshold = (unspecified > 0.05 * hardwood) | (unspecified > 0.05 * softwood)
 
-        hardwood = hardwood_rows['Volume (cubic metres) (En)'].sum() if len(hardwood_rows) > 0 else 0
-        softwood = softwood_rows['Volume (cubic metres) (En)'].sum() if len(softwood_rows) > 0 else 0
-        unspecified = unspecified_rows['Volume (cubic metres) (En)'].sum() if len(unspecified_rows) > 0 else 0
+    for year in over_threshold[over_threshold].index:
+        print(f"WARNING: Year {year} - Unspecified volume ({unspecified[year]:.0f} m³) exceeds 5% threshold")
+        print(f"  Hardwood: {hardwood[year]:.0f} m³, Softwood: {softwood[year]:.0f} m³")
 
-        # print("Year : " + str(year))
-        # print("Hardwoods : " + str(hardwood))
-        # print("Softwood : " + str(softwood))
-
-        if unspecified > 0.05 * hardwood or unspecified > 0.05 * softwood:
-            print(f"WARNING: Year {year} - Unspecified volume ({unspecified:.0f} m³) exceeds 5% threshold")
-            print(f"  Hardwood: {hardwood:.0f} m³, Softwood: {softwood:.0f} m³")
-
-    return harvest_by_year
+    # The volumes are returned with one row per year and one column per species group,
+    # so that the volumes of a year are direct lookups
+    return volumes_by_year
 
 
 def fast_resample_sum(src_array, src_transform, src_crs, dst_shape, dst_transform, dst_crs, output_path=None):
     """Faster resampling using GDAL"""
 
-    # Create temporary input file
-    with tempfile.NamedTemporaryFile(suffix='.tif', delete=False) as tmp_src:
-        tmp_src_path = tmp_src.name
-
-    # Write source array to temporary file
-    driver = gdal.GetDriverByName('GTiff')
-    src_ds = driver.Create(tmp_src_path, src_array.shape[1], src_array.shape[0], 1, gdal.GDT_Int16)
+    # Give the source array to GDAL through an in-memory dataset, without writing any temporary file
+    driver = gdal.GetDriverByName('MEM')
+    src_ds = driver.Create('', src_array.shape[1], src_array.shape[0], 1, gdal.GDT_Byte)
     src_ds.SetGeoTransform([src_transform[2], src_transform[0], src_transform[1],
                             src_transform[5], src_transform[3], src_transform[4]])
 
@@ -177,19 +222,20 @@ def fast_resample_sum(src_array, src_transform, src_crs, dst_shape, dst_transfor
     band = src_ds.GetRasterBand(1)
     band.WriteArray(src_array)
     band.SetNoDataValue(0)
-    band.FlushCache()
-    src_ds = None
 
-    # Create output file path
+    # The output is also kept in memory, unless it is saved to output_path
     if output_path is not None:
         out_path = str(output_path)
+        out_format = 'GTiff'
+        creation_options = ['COMPRESS=LZW']
     else:
-        with tempfile.NamedTemporaryFile(suffix='.tif', delete=False) as tmp_dst:
-            out_path = tmp_dst.name
+        out_path = ''
+        out_format = 'MEM'
+        creation_options = []
 
     # Set up warp options
     warp_options = gdal.WarpOptions(
-        format='GTiff',
+        format=out_format,
         outputBounds=(dst_transform[2], 
                      dst_transform[5] + dst_shape[0] * dst_transform[4],
                      dst_transform[2] + dst_shape[1] * dst_transform[0],
@@ -199,26 +245,19 @@ def fast_resample_sum(src_array, src_transform, src_crs, dst_shape, dst_transfor
         dstSRS=dst_crs.to_wkt() if hasattr(dst_crs, 'to_wkt') else str(dst_crs),
         resampleAlg='sum',
         outputType=gdal.GDT_Float32,
-        creationOptions=['COMPRESS=LZW'],
+        creationOptions=creation_options,
         dstNodata=0
     )
 
-    # Perform warp
+    # Perform warp, and read the result from the returned dataset
     print(f"    Running GDAL warp...")
-    gdal.Warp(out_path, tmp_src_path, options=warp_options)
-
-    # Read result
-    dst_ds = gdal.Open(out_path, gdalconst.GA_ReadOnly)
-    result = dst_ds.GetRasterBand(1).ReadAsArray().astype(np.float32)
+    dst_ds = gdal.Warp(out_path, src_ds, options=warp_options)
+    # The output band is already Float32 : no conversion copy is needed
+    result = dst_ds.GetRasterBand(1).ReadAsArray().astype(np.float32, copy=False)
     dst_ds = None
+    src_ds = None
 
-    # Clean up temporary source file
-    os.unlink(tmp_src_path)
-
-    # Clean up temporary output file if not saving
-    if output_path is None:
-        os.unlink(out_path)
-    else:
+    if output_path is not None:
         print(f"    Saved resampled raster to: {output_path}")
 
     # Ensure result matches expected shape
@@ -231,7 +270,57 @@ def fast_resample_sum(src_array, src_transform, src_crs, dst_shape, dst_transfor
 
     return result
 
-def process_year(year, conifer_vol, deciduous_vol, conifer_profile, provincePolygon, study_area, pixel_ratio):
+def sum_harvested_volumes(conifer_vol, deciduous_vol, harvest_percentage, inside_study_area):
+    """
+    Sums the harvested conifer and deciduous volumes (volume * harvest_percentage) over the Province
+    and over the study area, in a single pass over the rasters.
+
+    np.einsum computes each sum of products without ever writing the products to memory.
+    The rasters are processed by blocks of SUM_BLOCK_ROWS rows : the harvest percentages and the study
+    area mask of a block are shared by the two volumes while they are in the CPU cache, blocks without
+    any harvest are skipped, and the sums of each block are accumulated in float32 only over a few
+    hundred thousand pixels (the totals are in float64).
+    Volumes and harvest percentages are never negative, so the products are summed as they are.
+
+    Returns:
+    tuple: (conifer_province_sum, conifer_study_area_sum, deciduous_province_sum, deciduous_study_area_sum), in m³
+    """
+    conifer_province_sum = conifer_study_area_sum = 0.0
+    deciduous_province_sum = deciduous_study_area_sum = 0.0
+
+    for row in range(0, harvest_percentage.shape[0], SUM_BLOCK_ROWS):
+        rows = slice(row, row + SUM_BLOCK_ROWS)
+        harvest_block = harvest_percentage[rows]
+        # Harvests only cover a small part of the Province each year
+        if not harvest_block.any():
+            continue
+
+        study_block = inside_study_area[rows].astype(np.float32)
+        conifer_block = conifer_vol[rows]
+        deciduous_block = deciduous_vol[rows]
+        conifer_province_sum += float(np.einsum("ij,ij->", conifer_block, harvest_block))
+        conifer_study_area_sum += float(np.einsum("ij,ij,ij->", conifer_block, harvest_block, study_block))
+        deciduous_province_sum += float(np.einsum("ij,ij->", deciduous_block, harvest_block))
+        deciduous_study_area_sum += float(np.einsum("ij,ij,ij->", deciduous_block, harvest_block, study_block))
+
+    return conifer_province_sum, conifer_study_area_sum, deciduous_province_sum, deciduous_study_area_sum
+
+def get_province_geom(provincePolygon, crs):
+    """
+    Returns the province as a list with a single GeoJSON-like geometry in the given CRS.
+    The reprojection and the union are done only once per CRS (the CanLad rasters of all years share the same).
+    """
+    crs_key = crs.to_wkt()
+    if crs_key not in _province_geom_by_crs:
+        # Reproject provincePolygon if needed
+        if provincePolygon.crs != crs:
+            provincePolygon_reprojected = provincePolygon.to_crs(crs)
+        else:
+            provincePolygon_reprojected = provincePolygon
+        _province_geom_by_crs[crs_key] = [provincePolygon_reprojected.geometry.union_all().__geo_interface__]
+    return _province_geom_by_crs[crs_key]
+
+def process_year(year, conifer_vol, deciduous_vol, conifer_profile, provincePolygon, inside_study_area, pixel_ratio):
     print(f"\nProcessing year {year}...")
 
     # Load CanLad raster
@@ -242,37 +331,47 @@ def process_year(year, conifer_vol, deciduous_vol, conifer_profile, provincePoly
             # Get raster CRS
             raster_crs = src.crs
 
-            # Reproject provincePolygon if needed
-            if provincePolygon.crs != raster_crs:
-                provincePolygon_reprojected = provincePolygon.to_crs(raster_crs)
-            else:
-                provincePolygon_reprojected = provincePolygon
-
             print(f"  Cropping CanLad raster to {provincePolygon['gn_name']}...")
-            provincePolygon_geom = [provincePolygon_reprojected.geometry.union_all().__geo_interface__]
-            canlad_data, canlad_transform = mask(src, provincePolygon_geom, crop=True, all_touched=True)
+            provincePolygon_geom = get_province_geom(provincePolygon, raster_crs)
+            # The crop window and the mask of the province are computed without reading the raster
+            outside_province, canlad_transform, province_window = raster_geometry_mask(
+                src, provincePolygon_geom, crop=True, all_touched=True)
             canlad_profile = src.profile.copy()
             canlad_profile.update({
-                "height": canlad_data.shape[1],
-                "width": canlad_data.shape[2],
+                "height": outside_province.shape[0],
+                "width": outside_province.shape[1],
                 "transform": canlad_transform
             })
+
+            # Reclassify: 2 or 5 -> 1, else -> 0 (and 0 outside of the province)
+            # The window of the province is read by blocks of rows, and each block is reclassified directly
+            # into the byte harvest mask given to the warp : the raw CanLad classes of the whole province
+            # are never held in memory. Two direct comparisons are also much faster than np.isin for two values.
+            print(f"  Reclassifying harvest pixels...")
+            harvest_mask = np.empty(outside_province.shape, dtype=np.uint8)
+            for row in range(0, harvest_mask.shape[0], CANLAD_BLOCK_ROWS):
+                harvest_block = harvest_mask[row:row + CANLAD_BLOCK_ROWS].view(bool)
+                canlad_classes = src.read(1, window=Window(province_window.col_off, province_window.row_off + row,
+                                                           province_window.width, harvest_block.shape[0]))
+                np.equal(canlad_classes, 2, out=harvest_block)
+                harvest_block |= canlad_classes == 5
+                harvest_block &= ~outside_province[row:row + CANLAD_BLOCK_ROWS]
     except FileNotFoundError:
         print(f"  WARNING: CanLad file not found for year {year}, skipping...")
         return None, None
 
-    # Reclassify: 2 or 5 -> 1, else -> 0
-    print(f"  Reclassifying harvest pixels...")
-    harvest_mask = np.isin(canlad_data[0], [2, 5]).astype(np.int16)
-
     # Resample to 250m with sum - using GDAL
     print(f"  Resampling to 250m resolution...")
     dst_shape = (conifer_vol.shape[0], conifer_vol.shape[1])
 
-    # Create output path for debugging
-    output_dir = Path("./InputData/Rasters/resampled_debug")
-    output_dir.mkdir(exist_ok=True)
-    output_path = output_dir / f"canlad_resampled_250m_{year}.tif"
+    # Create output path for debugging, only if asked for with the MHS_CBAU_DEBUG_RESAMPLE environment
+    # variable : otherwise, the resampled raster stays in memory and is never compressed nor written
+    if DEBUG_RESAMPLE:
+        output_dir = Path("./InputData/Rasters/resampled_debug")
+        output_dir.mkdir(exist_ok=True)
+        output_path = output_dir / f"canlad_resampled_250m_{year}.tif"
+    else:
+        output_path = None
 
     resampled = fast_resample_sum(
         harvest_mask, 
@@ -286,46 +385,19 @@ def process_year(year, conifer_vol, deciduous_vol, conifer_profile, provincePoly
 
     # Convert count to percentage
     print(f"  Converting to harvest percentage...")
-    harvest_percentage = resampled * pixel_ratio
-    harvest_percentage = np.clip(harvest_percentage, 0, 100) / 100.0  # Convert to 0-1 range
+    # Done in place in the resampled array, in the 0-1 range directly (the counts are never
+    # negative, so only the upper bound of the clip is needed)
+    harvest_percentage = resampled
+    np.multiply(harvest_percentage, np.float32(pixel_ratio / 100.0), out=harvest_percentage)
+    np.minimum(harvest_percentage, np.float32(1.0), out=harvest_percentage)
 
-    # Calculate harvested volumes
+    # Calculate harvested volumes and sum them for the Province and the study area
     print(f"  Calculating harvested volumes...")
-    conifer_harvested = conifer_vol * harvest_percentage
-    deciduous_harvested = deciduous_vol * harvest_percentage
-
-    # Sum for Province
-    conifer_provincePolygon_sum = np.sum(conifer_harvested[conifer_harvested > 0])
-    deciduous_provincePolygon_sum = np.sum(deciduous_harvested[deciduous_harvested > 0])
+    (conifer_provincePolygon_sum, conifer_study_sum,
+     deciduous_provincePolygon_sum, deciduous_study_sum) = sum_harvested_volumes(conifer_vol, deciduous_vol,
+                                                                                 harvest_percentage, inside_study_area)
 
     print(f"  Province totals - Conifer: {conifer_provincePolygon_sum:.2f} m³, Deciduous: {deciduous_provincePolygon_sum:.2f} m³")
-
-    # Mask to study area
-    print(f"  Masking to study area...")
-
-    # Reproject study area if needed
-    if study_area.crs != conifer_profile['crs']:
-        study_area_reprojected = study_area.to_crs(conifer_profile['crs'])
-    else:
-        study_area_reprojected = study_area
-
-    study_geom = [study_area_reprojected.geometry.union_all().__geo_interface__]
-
-    # Create temporary raster for masking
-    with rasterio.MemoryFile() as memfile:
-        with memfile.open(**conifer_profile) as mem_dataset:
-            mem_dataset.write(conifer_harvested, 1)
-            conifer_study, _ = mask(mem_dataset, study_geom, crop=False, all_touched=True)
-
-    with rasterio.MemoryFile() as memfile:
-        with memfile.open(**conifer_profile) as mem_dataset:
-            mem_dataset.write(deciduous_harvested, 1)
-            deciduous_study, _ = mask(mem_dataset, study_geom, crop=False, all_touched=True)
-
-    # Sum for study area
-    conifer_study_sum = np.sum(conifer_study[conifer_study > 0])
-    deciduous_study_sum = np.sum(deciduous_study[deciduous_study > 0])
-
     print(f"  Study area totals - Conifer: {conifer_study_sum:.2f} m³, Deciduous: {deciduous_study_sum:.2f} m³")
 
     # Calculate ratios
@@ -336,6 +408,15 @@ def process_year(year, conifer_vol, deciduous_vol, conifer_profile, provincePoly
 
     return conifer_ratio, deciduous_ratio
 
+def init_year_worker(conifer_vol, deciduous_vol, conifer_profile, provincePolygon, inside_study_area, pixel_ratio):
+    """Stores the data shared by all of the years in a worker process, so that it is sent once per process instead of once per year."""
+    _year_worker_data.update(conifer_vol=conifer_vol, deciduous_vol=deciduous_vol, conifer_profile=conifer_profile,
+                             provincePolygon=provincePolygon, inside_study_area=inside_study_area, pixel_ratio=pixel_ratio)
+
+def process_year_in_worker(year):
+    """Runs process_year in a worker process initialized by init_year_worker."""
+    return process_year(year, **_year_worker_data)
+
 def main():
     print("="*60)
     print("ANNUAL HARVEST VOLUME ANALYSIS")
@@ -344,7 +425,7 @@ def main():
     # Load shapefiles
     print("\nLoading shapefiles...")
     provinceName, provincePolygon = get_province_from_landscape()
-    study_area = gpd.read_file("./InputData/study_landscape.shp")
+    study_area = gpd.read_file("./InputData/study_landscape.shp", engine='pyogrio')
 
     print(f"{provinceName} shapefile CRS: {provincePolygon.crs}")
     print(f"Study area shapefile CRS: {study_area.crs}")
@@ -358,36 +439,50 @@ def main():
     conifer_path = base_path / "temp_conifer_volume_2001.tif"
     deciduous_path = base_path / "temp_deciduous_volume_2001.tif"
 
+    # The volumes are read as float32, so that no computation on them is done in float64
     with rasterio.open(conifer_path) as src:
-        conifer_vol = src.read(1)
+        conifer_vol = src.read(1, out_dtype=np.float32)
         conifer_profile = src.profile
         print(f"NFI raster CRS: {src.crs}")
 
     with rasterio.open(deciduous_path) as src:
-        deciduous_vol = src.read(1)
+        deciduous_vol = src.read(1, out_dtype=np.float32)
+
+    # Mask to study area
+    # The study area and the grid of the NFI rasters are the same for all of the years : the study area
+    # is reprojected and rasterized (True inside) only once, and the mask is used by the sums of every year
+    print("Rasterizing study area...")
+    if study_area.crs != conifer_profile['crs']:
+        study_area = study_area.to_crs(conifer_profile['crs'])
+    study_geom = [study_area.geometry.union_all().__geo_interface__]
+    inside_study_area = geometry_mask(study_geom, out_shape=conifer_vol.shape, transform=conifer_profile['transform'],
+                                      all_touched=True, invert=True)
 
     # Calculate pixel ratio (30m to 250m)
     pixel_ratio = (30 * 30) / (250 * 250)
     print(f"Pixel ratio (30m to 250m): {pixel_ratio:.6f}")
 
-    # Process each year
+    # Process each year; the years are independent, and are processed in parallel by worker
+    # processes that receive the NFI rasters only once (see init_year_worker)
     results = []
+    years = range(2000, 2021)
+    year_worker_args = (conifer_vol, deciduous_vol, conifer_profile, provincePolygon, inside_study_area, pixel_ratio)
 
-    for year in range(2000, 2021):
-        conifer_ratio, deciduous_ratio = process_year(
-            year, conifer_vol, deciduous_vol, conifer_profile, 
-            provincePolygon, study_area, pixel_ratio
-        )
+    if MAX_PARALLEL_YEARS > 1:
+        with ProcessPoolExecutor(max_workers=MAX_PARALLEL_YEARS, initializer=init_year_worker,
+                                 initargs=year_worker_args) as executor:
+            year_ratios = list(executor.map(process_year_in_worker, years))
+    else:
+        # With a single worker, the years are processed in this process : the NFI rasters
+        # are used directly, instead of being copied (and pickled) into a worker process
+        init_year_worker(*year_worker_args)
+        year_ratios = list(map(process_year_in_worker, years))
 
+    for year, (conifer_ratio, deciduous_ratio) in zip(years, year_ratios):
         if conifer_ratio is not None:
             # Get harvest volumes from CSV - FIXED
-            year_harvest = harvest_data[harvest_data['Year'] == year]
-
-            softwood_rows = year_harvest[year_harvest['Species group'] == 'Softwoods']
-            hardwood_rows = year_harvest[year_harvest['Species group'] == 'Hardwoods']
-
-            softwood_vol = softwood_rows['Volume (cubic metres) (En)'].sum() if len(softwood_rows) > 0 else 0
-            hardwood_vol = hardwood_rows['Volume (cubic metres) (En)'].sum() if len(hardwood_rows) > 0 else 0
+            softwood_vol = harvest_data.at[year, 'Softwoods'] if year in harvest_data.index else 0
+            hardwood_vol = harvest_data.at[year, 'Hardwoods'] if year in harvest_data.index else 0
 
             print(f"  CSV volumes - Softwoods: {softwood_vol:.2f} m³, Hardwoods: {hardwood_vol:.2f} m³")
 
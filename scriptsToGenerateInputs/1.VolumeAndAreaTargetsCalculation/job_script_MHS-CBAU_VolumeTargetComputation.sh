@@ -8,8 +8,8 @@
 #SBATCH --mail-type=ALL
 #SBATCH --time=00-06:00 # time (DD-HH:MM)
 #SBATCH --ntasks=1 # number of MPI processes
-#SBATCH --mem=40GB
-#SBATCH --cpus-per-task=1
+#SBATCH --mem=160GB # about 40GB per year processed in parallel (see MHS_CBAU_PARALLEL_YEARS below)
+#SBATCH --cpus-per-task=4
 #SBATCH --job-name=MHS-CBAU_VolumeTargetComputation
 #SBATCH --output=%x-%j.out
 
@@ -27,9 +27,12 @@ cd $SLURM_TMPDIR/
 virtualenv --no-download PythonEnv
 source PythonEnv/bin/activate
 pip install --no-index --upgrade pip
-pip install --no-index rasterio numpy geopandas gdal
+pip install --no-index rasterio numpy geopandas pyogrio gdal
 
 # Launching the scripts
+# One year is processed per CPU by 4.analyzeAnnualHarvest.py; each of them needs about 40GB for a large province
+# like Quebec, so lower this (or raise --mem) if the job runs out of memory
+export MHS_CBAU_PARALLEL_YEARS=$SLURM_CPUS_PER_TASK
 python -u 3.processNFI_Rasters.py
 python -u 4.analyzeAnnualHarvest.py
 
@@ -20,8 +20,9 @@ def extract_filtered_zip(zip_path, extract_to, include_string, exclude_strings):
             if include_string in f and not any(excl in f for excl in exclude_strings):
                 filtered_files.append(f)
 
+        # All members are extracted in one call instead of one extract() call per member
+        zip_ref.extractall(extract_to, members=filtered_files)
         for file in filtered_files:
-            zip_ref.extract(file, extract_to)
             print(f"  Extracted: {file}")
     print(f"Extraction complete. {len(filtered_files)} files extracted.")
 
@@ -48,11 +49,12 @@ def main():
     subprocess.run([str(python_path), "-m", "pip", "install", "--upgrade", "pip"], check=True)
 
     # Install packages
-    packages = ["pandas", "numpy", "fiona", "geopandas", "shapely", "pyogrio", "tqdm", "pyarrow"]
+    packages = ["pandas", "numpy", "geopandas", "shapely", "pyogrio", "tqdm", "pyarrow"]
 
-    for package in packages:
-        print(f"Installing {package}...")
-        subprocess.run([str(python_path), "-m", "pip", "install", package], check=True)
+    # All of the packages are installed with a single pip call, so that the dependencies are resolved
+    # only once; --no-compile skips the .pyc generation (done on first import anyway)
+    print(f"Installing {', '.join(packages)}...")
+    subprocess.run([str(python_path), "-m", "pip", "install", "--no-compile", "--prefer-binary", *packages], check=True)
 
     print("\n=== Setup Complete ===")
     print(f"Python environment created at: {python_env_dir}")
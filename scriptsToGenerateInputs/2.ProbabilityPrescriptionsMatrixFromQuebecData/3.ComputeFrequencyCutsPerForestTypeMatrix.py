@@ -1,14 +1,15 @@
 import json
+import os
 import pandas as pd
 import numpy as np
 from pathlib import Path
-import fiona
-from fiona.crs import from_epsg
 import geopandas as gpd
-from shapely.geometry import shape, mapping, MultiPolygon, Polygon
 from shapely import STRtree, intersection, area, prepare
 import pyogrio
+import pyogrio.raw
+import shapely
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -16,311 +17,368 @@ warnings.filterwarnings('ignore')
 forest_inv_gdb = "./InputData/CARTE_ECO_ORI_PROV.gdb"
 forest_cut_gdb = "./InputData/INTERV_FORES_PROV.gdb"
 clipped_gpkg = "INTERV_FORES_PROV_CLIPPED.gpkg"
-BUFFER_SIZE = 5000
-
-# Load JSON files
-print("=== Step 1: Loading JSON files ===")
-with open('./InputData/ShadeToleranceSpeciesQuebec.json', 'r', encoding='utf-8') as f:
-    shade_tolerance = json.load(f)
-
-with open('./InputData/CutTypeCategories.json', 'r', encoding='utf-8') as f:
-    cut_categories = json.load(f)
-
-# Load forest cut data (smaller dataset)
-if not Path(clipped_gpkg).exists():
-    print("\n=== Step 2: Loading forest cut data ===")
-    interv_fores_gdf = pyogrio.read_dataframe(
-        forest_cut_gdb,
-        layer="INTERV_FORES_PROV",
-        columns=['EXERCICE', 'ORIGINE', 'AN_ORIGINE', 'PERTURB', 'AN_PERTURB', 
-                 'REB_ESS1', 'REB_ESS2', 'REB_ESS3'],
-        use_arrow=True
-    )
-    print(f"Loaded {len(interv_fores_gdf)} forest cut polygons")
-
-# Build spatial index for interventions
-print("Building spatial index for interventions...")
-interv_geoms = interv_fores_gdf.geometry.values
-for geom in interv_geoms:
-    prepare(geom)
-interv_tree = STRtree(interv_geoms)
-print("Spatial index built")
-
-# Reclassification functions
-age_classes = ["10", "20", "30", "40", "50", "60", "70", "80", "90", "100", "110", "120", "130", "140"]
-
-def reclassify_cl_age(cl_age):
-    if pd.notna(cl_age) and str(cl_age) in age_classes:
-        return "Even"
-    elif pd.notna(cl_age):
-        return "Uneven"
-    return None
-
-def classify_shade_tolerance(gr_ess):
-    if pd.isna(gr_ess):
-        return None
-    species_code = str(gr_ess)[:2]
-    if species_code in shade_tolerance:
-        tolerance = shade_tolerance[species_code].get('tolerance_ombre', 'Unknown')
-        return "Tol" if tolerance == "Tolérant" else "Intol" if tolerance == "Intolérant" else "Unknown"
-    return "Unknown"
-
-def extract_polygons(geom):
-    """Extract individual polygons from geometry (handles both Polygon and MultiPolygon)"""
-    if isinstance(geom, MultiPolygon):
-        return list(geom.geoms)
-    elif isinstance(geom, Polygon):
-        return [geom]
+BUFFER_SIZE = 50000
+# Number of forest inventory polygons read at once from the GDB
+INVENTORY_BATCH_SIZE = 50000
+# Side (in m) of the square tiles by which the interventions are intersected with the forest inventory
+TILE_SIZE = 10000
+# Tolerance (in m) of the simplified interventions used by the spatial index of each tile
+SIMPLIFY_TOLERANCE = 5
+# Number of tiles processed in parallel (the CPUs allocated to this process, e.g. by SLURM)
+MAX_PARALLEL_TILES = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+# SQLite cache (in MB) used by GDAL when writing the clipped GeoPackage, instead of its default of a few MB
+pyogrio.set_gdal_config_options({'OGR_SQLITE_CACHE': '200'})
+
+# Data shared by all of the tiles in a worker process, set by init_tile_worker
+_tile_worker_data = {}
+
+# Reclassification of the forest inventory attributes
+AGE_CLASSES = frozenset(["10", "20", "30", "40", "50", "60", "70", "80", "90", "100", "110", "120", "130", "140"])
+
+def build_shade_tolerance_classes(shade_tolerance):
+    """Returns the dict of the shade tolerance class (Tol, Intol or Unknown) of each 2-letter species code."""
+    classes = {}
+    for species_code, values in shade_tolerance.items():
+        tolerance = values.get('tolerance_ombre', 'Unknown')
+        classes[species_code] = "Tol" if tolerance == "Tolérant" else "Intol" if tolerance == "Intolérant" else "Unknown"
+    return classes
+
+def intersect_tile(tile_interv_idx, interv_geoms, shade_tolerance_classes):
+    """Intersect the interventions of one tile with the forest inventory polygons around them.
+    Returns the intersected polygons, the index of the intervention of each polygon, and the reclassified
+    CL_AGE, GR_ESS and CO_TER of the inventory polygon of each polygon."""
+    tile_geoms = interv_geoms[tile_interv_idx]
+
+    # The candidate pairs are filtered on simplified copies of the interventions, on which the predicate is cheaper
+    # to evaluate. The simplified outlines stay within SIMPLIFY_TOLERANCE of the original ones, so testing within that
+    # distance still finds every pair that really intersects; the intersections themselves use the original geometries.
+    tile_tree = STRtree(tile_geoms)
+    tile_simplified = shapely.simplify(tile_geoms, SIMPLIFY_TOLERANCE, preserve_topology=True)
+
+    # Only the inventory polygons that overlap the extent of the interventions of the tile are read,
+    # through the spatial index of the GDB
+    tile_bounds = shapely.bounds(tile_geoms)
+    tile_bbox = tuple(np.concatenate([tile_bounds[:, :2].min(axis=0), tile_bounds[:, 2:].max(axis=0)]).tolist())
+
+    polygons_out, interv_out, cl_age_out, gr_ess_out, co_ter_out = [], [], [], [], []
+
+    # The forest inventory is streamed as Arrow record batches : the attributes arrive as columns, and the
+    # geometries as WKB that shapely decodes for the whole batch at once, instead of building a GeoJSON-like
+    # dict and a shape() for each feature
+    with pyogrio.raw.open_arrow(forest_inv_gdb, layer="PEE_ORI_PROV", columns=['CL_AGE', 'GR_ESS', 'CO_TER'],
+                                bbox=tile_bbox, batch_size=INVENTORY_BATCH_SIZE, use_pyarrow=True) as (meta, reader):
+        geometry_column = meta['geometry_name'] or 'wkb'
+
+        for batch in reader:
+            pee_geoms = shapely.from_wkb(batch.column(geometry_column).to_numpy(zero_copy_only=False))
+            # The attributes of the whole batch are reclassified at once : CL_AGE is Even for the age classes and
+            # Uneven otherwise, and GR_ESS takes the shade tolerance of the species of its first 2 letters.
+            # The missing values stay missing.
+            cl_ages = batch.column('CL_AGE').to_pandas().astype('string')
+            cl_ages_reclass = np.where(cl_ages.isin(AGE_CLASSES), "Even", "Uneven").astype(object)
+            cl_ages_reclass[cl_ages.isna().to_numpy()] = None
+            gr_esss = batch.column('GR_ESS').to_pandas().astype('string')
+            gr_esss_reclass = gr_esss.str[:2].map(shade_tolerance_classes).fillna("Unknown").to_numpy(dtype=object)
+            gr_esss_reclass[gr_esss.isna().to_numpy()] = None
+            co_ters = batch.column('CO_TER').to_pandas().astype('string').to_numpy(dtype=object, na_value=None)
+
+            # All of the (inventory polygon, intervention) pairs whose bounding boxes intersect in the batch,
+            # found in one call. Most inventory polygons read around the tile have no candidate at all.
+            pee_idx, interv_idx = tile_tree.query(pee_geoms)
+            has_candidates = np.bincount(pee_idx, minlength=len(pee_geoms)) > 0
+
+            # The inventory polygons are the side that is tested against many candidates : they are the ones
+            # we prepare, only if they have candidates, and only for the duration of their batch
+            prepare(pee_geoms[has_candidates])
+            pee_bounds = shapely.bounds(pee_geoms)
+
+            # Pairs that can really intersect
+            kept = shapely.dwithin(pee_geoms[pee_idx], tile_simplified[interv_idx], SIMPLIFY_TOLERANCE)
+            pee_idx, interv_idx = pee_idx[kept], interv_idx[kept]
+
+            if len(pee_idx) > 0:
+                # Intersection of all of the pairs at once, keeping only those of at least 1 m².
+                # When one polygon of a pair lies entirely inside the other, the inner one is the intersection,
+                # which the prepared inventory polygon tells us without computing the overlay. Containment is only
+                # possible if the bounding box of the inner polygon is inside the one of the outer polygon, which
+                # NumPy checks first for all of the pairs.
+                pair_pee_bounds = pee_bounds[pee_idx]
+                pair_interv_bounds = tile_bounds[interv_idx]
+                interv_in_pee_bbox = ((pair_interv_bounds[:, :2] >= pair_pee_bounds[:, :2]).all(axis=1)
+                                      & (pair_interv_bounds[:, 2:] <= pair_pee_bounds[:, 2:]).all(axis=1))
+                pee_in_interv_bbox = ((pair_pee_bounds[:, :2] >= pair_interv_bounds[:, :2]).all(axis=1)
+                                      & (pair_pee_bounds[:, 2:] <= pair_interv_bounds[:, 2:]).all(axis=1))
+
+                intersect_geoms = tile_geoms[interv_idx]
+                interv_inside = np.zeros(len(pee_idx), dtype=bool)
+                interv_inside[interv_in_pee_bbox] = shapely.contains_properly(
+                    pee_geoms[pee_idx[interv_in_pee_bbox]], intersect_geoms[interv_in_pee_bbox])
+                pee_inside = np.zeros(len(pee_idx), dtype=bool)
+                candidates = pee_in_interv_bbox & ~interv_inside
+                pee_inside[candidates] = shapely.covered_by(pee_geoms[pee_idx[candidates]], intersect_geoms[candidates])
+                intersect_geoms[pee_inside] = pee_geoms[pee_idx[pee_inside]]
+
+                overlay = ~(interv_inside | pee_inside)
+                intersect_geoms[overlay] = intersection(pee_geoms[pee_idx[overlay]], intersect_geoms[overlay])
+                kept = area(intersect_geoms) >= 1
+                pee_idx, interv_idx, intersect_geoms = pee_idx[kept], interv_idx[kept], intersect_geoms[kept]
+
+                # Split the MultiPolygons into individual polygons; pair_idx gives the pair of each polygon
+                polygons, pair_idx = shapely.get_parts(intersect_geoms, return_index=True)
+                kept = (shapely.get_type_id(polygons) == 3) & (area(polygons) >= 1)
+                polygons, pair_idx = polygons[kept], pair_idx[kept]
+
+                polygons_out.append(polygons)
+                interv_out.append(tile_interv_idx[interv_idx[pair_idx]])
+                polygon_pees = pee_idx[pair_idx]
+                cl_age_out.extend(cl_ages_reclass[polygon_pees])
+                gr_ess_out.extend(gr_esss_reclass[polygon_pees])
+                co_ter_out.extend(co_ters[polygon_pees])
+
+            shapely.destroy_prepared(pee_geoms[has_candidates])
+
+    if not polygons_out:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), [], [], []
+    return np.concatenate(polygons_out), np.concatenate(interv_out), cl_age_out, gr_ess_out, co_ter_out
+
+def init_tile_worker(interv_geoms_wkb, shade_tolerance_classes):
+    """Stores the data shared by all of the tiles in a worker process, so that it is sent once per process instead of once per tile.
+    The interventions are sent as WKB and decoded in the worker."""
+    _tile_worker_data.update(interv_geoms=shapely.from_wkb(interv_geoms_wkb), shade_tolerance_classes=shade_tolerance_classes)
+
+def intersect_tile_in_worker(tile_interv_idx):
+    """Runs intersect_tile in a worker process initialized by init_tile_worker, returning the polygons as WKB."""
+    polygons, polygon_interv, cl_ages, gr_esss, co_ters = intersect_tile(tile_interv_idx, **_tile_worker_data)
+    return shapely.to_wkb(polygons), polygon_interv, cl_ages, gr_esss, co_ters
+
+def main():
+    # Load JSON files
+    print("=== Step 1: Loading JSON files ===")
+    with open('./InputData/ShadeToleranceSpeciesQuebec.json', 'r', encoding='utf-8') as f:
+        shade_tolerance = json.load(f)
+
+    with open('./InputData/CutTypeCategories.json', 'r', encoding='utf-8') as f:
+        cut_categories = json.load(f)
+
+    # Check if clipped data exists
+    if Path(clipped_gpkg).exists():
+        print(f"\n=== Step 3: Loading existing clipped data with Fiona ===")
+        try:
+            # # Read using Fiona and convert to GeoDataFrame
+            # with fiona.open(clipped_gpkg) as src:
+                # features = list(src)
+                # crs = src.crs
+
+            # # Convert to GeoDataFrame
+            # geometries = [shape(f['geometry']) for f in features]
+            # properties = [f['properties'] for f in features]
+            # interv_clipped = gpd.GeoDataFrame(properties, geometry=geometries, crs=crs)
+            interv_clipped = pyogrio.read_dataframe(
+                clipped_gpkg, 
+                use_arrow=True
+            )
+            print(f"Loaded {len(interv_clipped)} clipped polygons")
+        except Exception as e:
+            print(f"Error reading existing file: {e}")
+            print("Deleting corrupted file and regenerating...")
+            Path(clipped_gpkg).unlink()
+            interv_clipped = None
     else:
-        return []
-
-# Check if clipped data exists
-if Path(clipped_gpkg).exists():
-    del(interv_fores_gdf)
-    print(f"\n=== Step 3: Loading existing clipped data with Fiona ===")
-    try:
-        # # Read using Fiona and convert to GeoDataFrame
-        # with fiona.open(clipped_gpkg) as src:
-            # features = list(src)
-            # crs = src.crs
-
-        # # Convert to GeoDataFrame
-        # geometries = [shape(f['geometry']) for f in features]
-        # properties = [f['properties'] for f in features]
-        # interv_clipped = gpd.GeoDataFrame(properties, geometry=geometries, crs=crs)
-        interv_clipped = pyogrio.read_dataframe(
-            clipped_gpkg, 
-            use_arrow=True
-        )
-        print(f"Loaded {len(interv_clipped)} clipped polygons")
-    except Exception as e:
-        print(f"Error reading existing file: {e}")
-        print("Deleting corrupted file and regenerating...")
-        Path(clipped_gpkg).unlink()
         interv_clipped = None
-else:
-    interv_clipped = None
-
-if interv_clipped is None:
-    print(f"\n=== Step 3: Processing forest inventory polygons one-by-one ===")
-
-    with fiona.open(forest_inv_gdb, layer="PEE_ORI_PROV") as src:
-        total_features = len(src)
-        crs = src.crs
-
-        # Define schema for output
-        schema = {
-            'geometry': 'Polygon',
-            'properties': {
-                'EXERCICE': 'str',
-                'ORIGINE': 'str',
-                'AN_ORIGINE': 'str',
-                'PERTURB': 'str',
-                'AN_PERTURB': 'str',
-                'REB_ESS1': 'str',
-                'REB_ESS2': 'str',
-                'REB_ESS3': 'str',
-                'CL_AGE': 'str',
-                'GR_ESS': 'str',
-                'CO_TER': 'str'
-            }
-        }
-
-        print(f"Total forest inventory polygons: {total_features}")
-        print("Filtering and intersecting polygons...")
 
-        # Open output file for writing with buffering
-        with fiona.open(clipped_gpkg, 'w', driver='GPKG', crs=crs, schema=schema) as dst:
-            buffer = []
-            count = 0
-
-            for feature in tqdm(src, total=total_features, desc="Processing"):
-                pee_geom = shape(feature['geometry'])
-                props = feature['properties']
-
-                cl_age = props.get('CL_AGE')
-                gr_ess = props.get('GR_ESS')
-                co_ter = props.get('CO_TER')
-
-                cl_age_reclass = reclassify_cl_age(cl_age)
-                gr_ess_reclass = classify_shade_tolerance(gr_ess)
-
-                potential_idx = interv_tree.query(pee_geom, predicate='intersects')
-
-                if len(potential_idx) == 0:
-                    continue
-
-                for interv_idx in potential_idx:
-                    interv_geom = interv_geoms[interv_idx]
-                    intersect_geom = intersection(pee_geom, interv_geom)
-
-                    if intersect_geom.is_empty or intersect_geom.area < 1:
-                        continue
-
-                    interv_row = interv_fores_gdf.iloc[interv_idx]
-
-                    # Extract individual polygons (handles MultiPolygon)
-                    polygons = extract_polygons(intersect_geom)
-
-                    for poly in polygons:
-                        if poly.area < 1:
-                            continue
-
-                        # Add to buffer
-                        feature_out = {
-                            'geometry': mapping(poly),
-                            'properties': {
-                                'EXERCICE': str(interv_row['EXERCICE']) if pd.notna(interv_row['EXERCICE']) else None,
-                                'ORIGINE': str(interv_row['ORIGINE']) if pd.notna(interv_row['ORIGINE']) else None,
-                                'AN_ORIGINE': str(interv_row['AN_ORIGINE']) if pd.notna(interv_row['AN_ORIGINE']) else None,
-                                'PERTURB': str(interv_row['PERTURB']) if pd.notna(interv_row['PERTURB']) else None,
-                                'AN_PERTURB': str(interv_row['AN_PERTURB']) if pd.notna(interv_row['AN_PERTURB']) else None,
-                                'REB_ESS1': str(interv_row['REB_ESS1']) if pd.notna(interv_row['REB_ESS1']) else None,
-                                'REB_ESS2': str(interv_row['REB_ESS2']) if pd.notna(interv_row['REB_ESS2']) else None,
-                                'REB_ESS3': str(interv_row['REB_ESS3']) if pd.notna(interv_row['REB_ESS3']) else None,
-                                'CL_AGE': cl_age_reclass,
-                                'GR_ESS': gr_ess_reclass,
-                                'CO_TER': str(co_ter) if pd.notna(co_ter) else None
-                            }
-                        }
-                        buffer.append(feature_out)
-                        count += 1
-
-                        # Write buffer when it reaches BUFFER_SIZE
-                        if len(buffer) >= BUFFER_SIZE:
-                            dst.writerecords(buffer)
-                            buffer = []
-
-            # Write remaining features in buffer
-            if buffer:
-                dst.writerecords(buffer)
-
-        print(f"\nWrote {count} intersected polygons to {clipped_gpkg}")
-
-    # Load the file we just created using Fiona
-    print("Loading clipped data...")
-    del(interv_fores_gdf)
-    # with fiona.open(clipped_gpkg) as src:
-        # features = list(src)
-        # crs = src.crs
-    # geometries = [shape(f['geometry']) for f in features]
-    # properties = [f['properties'] for f in features]
-    # interv_clipped = gpd.GeoDataFrame(properties, geometry=geometries, crs=crs)
-    interv_clipped = pyogrio.read_dataframe(
-            clipped_gpkg, 
+    if interv_clipped is None:
+        # Load forest cut data (smaller dataset)
+        # (only needed when the clipped data has to be generated)
+        print("\n=== Step 2: Loading forest cut data ===")
+        interv_fores_gdf = pyogrio.read_dataframe(
+            forest_cut_gdb,
+            layer="INTERV_FORES_PROV",
+            columns=['EXERCICE', 'ORIGINE', 'AN_ORIGINE', 'PERTURB', 'AN_PERTURB', 
+                     'REB_ESS1', 'REB_ESS2', 'REB_ESS3'],
             use_arrow=True
         )
+        print(f"Loaded {len(interv_fores_gdf)} forest cut polygons")
+
+        # The interventions without geometry can't intersect anything
+        interv_fores_gdf = interv_fores_gdf[interv_fores_gdf.geometry.notna() & ~interv_fores_gdf.geometry.is_empty]
+        interv_fores_gdf = interv_fores_gdf.reset_index(drop=True)
+        interv_geoms = interv_fores_gdf.geometry.to_numpy()
+
+        print(f"\n=== Step 3: Processing forest inventory polygons by tiles ===")
+
+        # The interventions are grouped by the tile of TILE_SIZE that contains the lower left corner of their bounding
+        # box. Each tile then intersects its interventions with the inventory polygons read around them, with a small
+        # local spatial index : every (inventory polygon, intervention) pair is computed by a single tile, nearby
+        # polygons are processed together, and the parts of the inventory far from any cut are never read.
+        interv_corners = np.floor(shapely.bounds(interv_geoms)[:, :2] / TILE_SIZE).astype(np.int64)
+        interv_corners -= interv_corners.min(axis=0)
+        corner_ids = interv_corners[:, 0] * (interv_corners[:, 1].max() + 1) + interv_corners[:, 1]
+        _, tile_of_interv = np.unique(corner_ids, return_inverse=True)
+        tile_of_interv = tile_of_interv.ravel()
+        interv_by_tile = np.argsort(tile_of_interv, kind='stable')
+        tiles = np.split(interv_by_tile, np.cumsum(np.bincount(tile_of_interv))[:-1])
+
+        # The tiles are dispatched by decreasing amount of work, estimated by the number of vertices of their
+        # interventions : the heaviest tiles start first, instead of one of them running alone at the end
+        tile_work = np.bincount(tile_of_interv, weights=shapely.get_num_coordinates(interv_geoms))
+        tiles = [tiles[tile] for tile in np.argsort(-tile_work, kind='stable')]
+
+        crs = pyogrio.read_info(forest_inv_gdb, layer="PEE_ORI_PROV")['crs']
+
+        print(f"Total tiles containing interventions: {len(tiles)}")
+        print("Filtering and intersecting polygons...")
 
-# Calculate area
-print("\n=== Step 4: Calculating polygon areas ===")
-interv_clipped['AREACUT'] = interv_clipped.geometry.apply(lambda g: area(g))
-print(f"Area calculated, total area: {interv_clipped['AREACUT'].sum():.2f} m²")
-
-# Create CUTTYPE attribute
-print("\n=== Step 5: Creating CUTTYPE attribute ===")
-interv_clipped['CUTTYPE'] = interv_clipped.apply(
-    lambda row: row['PERTURB'] if pd.notna(row['PERTURB']) else row['ORIGINE'], axis=1
-)
-
-# Reclassify CUTTYPE
-print("\n=== Step 6: Reclassifying CUTTYPE ===")
-def reclassify_cuttype(cuttype):
-    if pd.isna(cuttype):
-        return None
-    cuttype_str = str(cuttype)
-    if cuttype_str in cut_categories:
-        return cut_categories[cuttype_str].get('english_category', cuttype_str)
-    return cuttype_str
-
-interv_clipped['CUTTYPE'] = interv_clipped['CUTTYPE'].apply(reclassify_cuttype)
-print(f"CUTTYPE reclassified: {interv_clipped['CUTTYPE'].value_counts().to_dict()}")
-
-# Save final version
-interv_clipped.to_file(clipped_gpkg, driver='GPKG')
-print(f"Final version saved to {clipped_gpkg}")
-
-# Create forest type classification
-print("\n=== Step 7: Creating forest type classification ===")
-def classify_forest_type(row):
-    cl_age = row['CL_AGE']
-    gr_ess = row['GR_ESS']
-
-    if pd.isna(cl_age) or gr_ess == 'Unknown' or pd.isna(gr_ess):
-        return 'Unknown/Unclassified'
-    elif cl_age == 'Even' and gr_ess == 'Tol':
-        return 'Even/Tol'
-    elif cl_age == 'Uneven' and gr_ess == 'Tol':
-        return 'Uneven/Tol'
-    elif cl_age == 'Even' and gr_ess == 'Intol':
-        return 'Even/Intol'
-    elif cl_age == 'Uneven' and gr_ess == 'Intol':
-        return 'Uneven/Intol'
-    else:
-        return 'Unknown/Unclassified'
-
-interv_clipped['FOREST_TYPE'] = interv_clipped.apply(classify_forest_type, axis=1)
-
-# Create matrix
-print("\n=== Step 8: Creating matrix ===")
-total_area = interv_clipped['AREACUT'].sum()
+        # The attributes of the interventions are gathered by row for each intersected polygon, as Arrow-backed
+        # strings in which the missing values stay missing
+        interv_attributes = interv_fores_gdf.drop(columns=interv_fores_gdf.geometry.name).astype('string[pyarrow]')
+
+        # The intersected polygons are buffered, and each full buffer is written to the GeoPackage in a single
+        # call. The GeoPackage is only read back entirely, so it is written without a spatial index.
+        clipped_chunks = []
+        geoms_buf, interv_buf = [], []
+        inventory_buf = {'CL_AGE': [], 'GR_ESS': [], 'CO_TER': []}
+
+        def write_clipped_chunk():
+            # With empty buffers (no tile produced any polygon), an empty chunk is written with the same columns,
+            # so that the GeoPackage and the matrices are still created (with no cuts)
+            interv_rows = np.concatenate(interv_buf) if interv_buf else np.empty(0, dtype=np.intp)
+            geoms = np.concatenate(geoms_buf) if geoms_buf else np.empty(0, dtype=object)
+            chunk = interv_attributes.iloc[interv_rows].reset_index(drop=True)
+            for column, values in inventory_buf.items():
+                chunk[column] = pd.array(values, dtype='string[pyarrow]')
+                values.clear()
+            chunk = gpd.GeoDataFrame(chunk, geometry=geoms, crs=crs)
+            pyogrio.write_dataframe(chunk, clipped_gpkg, driver='GPKG', append=bool(clipped_chunks),
+                                    SPATIAL_INDEX='NO')
+            clipped_chunks.append(chunk)
+            geoms_buf.clear()
+            interv_buf.clear()
+
+        # The tiles are independent : they are dispatched to worker processes, each with its own copy of the
+        # interventions, and their results are gathered and written here as they arrive
+        with ProcessPoolExecutor(max_workers=MAX_PARALLEL_TILES, initializer=init_tile_worker,
+                                 initargs=(shapely.to_wkb(interv_geoms),
+                                           build_shade_tolerance_classes(shade_tolerance))) as executor, \
+                tqdm(total=len(tiles), desc="Processing") as progress:
+            for polygons_wkb, polygon_interv, cl_ages, gr_esss, co_ters in executor.map(intersect_tile_in_worker, tiles):
+                # Add to buffer
+                geoms_buf.append(shapely.from_wkb(polygons_wkb))
+                interv_buf.append(polygon_interv)
+                inventory_buf['CL_AGE'].extend(cl_ages)
+                inventory_buf['GR_ESS'].extend(gr_esss)
+                inventory_buf['CO_TER'].extend(co_ters)
+
+                # Write buffer when it reaches BUFFER_SIZE
+                if len(inventory_buf['CL_AGE']) >= BUFFER_SIZE:
+                    write_clipped_chunk()
+
+                progress.update(1)
+
+        # Write remaining features in buffer
+        if inventory_buf['CL_AGE'] or not clipped_chunks:
+            if not inventory_buf['CL_AGE']:
+                print("WARNING : No cut polygon intersects the forest inventory; the matrices will be empty.")
+            write_clipped_chunk()
+
+        # The clipped data is already in memory : no need to read back the file we just created
+        del(interv_fores_gdf)
+        interv_clipped = pd.concat(clipped_chunks, ignore_index=True)
+        del(clipped_chunks)
+        print(f"\nWrote {len(interv_clipped)} intersected polygons to {clipped_gpkg}")
+
+    # Calculate area
+    print("\n=== Step 4: Calculating polygon areas ===")
+    interv_clipped['AREACUT'] = area(np.asarray(interv_clipped.geometry.array))
+    print(f"Area calculated, total area: {interv_clipped['AREACUT'].sum():.2f} m²")
+
+    # Create CUTTYPE attribute
+    print("\n=== Step 5: Creating CUTTYPE attribute ===")
+    interv_clipped['CUTTYPE'] = interv_clipped['PERTURB'].where(interv_clipped['PERTURB'].notna(),
+                                                                interv_clipped['ORIGINE'])
+
+    # Reclassify CUTTYPE
+    print("\n=== Step 6: Reclassifying CUTTYPE ===")
+    # The codes without an english category are kept as they are
+    cuttype_classes = {code: values.get('english_category', code) for code, values in cut_categories.items()}
+    cuttypes = interv_clipped['CUTTYPE'].astype('string')
+    interv_clipped['CUTTYPE'] = cuttypes.map(cuttype_classes).fillna(cuttypes)
+    print(f"CUTTYPE reclassified: {interv_clipped['CUTTYPE'].value_counts().to_dict()}")
+
+    # Create forest type classification
+    print("\n=== Step 7: Creating forest type classification ===")
+    # The two attributes only take a few values : as categories, the comparisons below are done on integer codes
+    cl_age = interv_clipped['CL_AGE'].astype('category')
+    gr_ess = interv_clipped['GR_ESS'].astype('category')
+
+    # Any missing or Unknown attribute falls in the default Unknown/Unclassified type
+    interv_clipped['FOREST_TYPE'] = np.select(
+        [(cl_age == 'Even') & (gr_ess == 'Tol'),
+         (cl_age == 'Uneven') & (gr_ess == 'Tol'),
+         (cl_age == 'Even') & (gr_ess == 'Intol'),
+         (cl_age == 'Uneven') & (gr_ess == 'Intol')],
+        ['Even/Tol', 'Uneven/Tol', 'Even/Intol', 'Uneven/Intol'],
+        default='Unknown/Unclassified'
+    )
 
-matrix = interv_clipped.groupby(['CUTTYPE', 'FOREST_TYPE'])['AREACUT'].sum().unstack(fill_value=0)
-matrix_pct = (matrix / total_area * 100).round(2)
+    # Create matrix
+    print("\n=== Step 8: Creating matrix ===")
+    # Only the three columns of the matrix are kept, with the two classifications as categories : the clipped
+    # polygons, with their geometries and other attributes, are freed before the group-by
+    matrix_df = interv_clipped[['CUTTYPE', 'FOREST_TYPE', 'AREACUT']].astype({'CUTTYPE': 'category',
+                                                                             'FOREST_TYPE': 'category'})
+    del(interv_clipped)
+    total_area = matrix_df['AREACUT'].sum()
 
-# Ensure all forest types are present
-forest_types = ['Even/Tol', 'Uneven/Tol', 'Even/Intol', 'Uneven/Intol', 'Unknown/Unclassified']
-for ft in forest_types:
-    if ft not in matrix_pct.columns:
-        matrix_pct[ft] = 0.0
+    matrix = matrix_df.groupby(['CUTTYPE', 'FOREST_TYPE'], observed=True)['AREACUT'].sum().unstack(fill_value=0)
 
-matrix_pct = matrix_pct[forest_types]
+    # Ensure all forest types are present
+    forest_types = ['Even/Tol', 'Uneven/Tol', 'Even/Intol', 'Uneven/Intol', 'Unknown/Unclassified']
+    matrix = matrix.reindex(columns=forest_types, fill_value=0.0)
 
-print("\n=== MATRIX: Percentage of surface harvested by cut type and forest type ===")
-print(matrix_pct)
+    matrix_pct = (matrix / total_area * 100).round(2)
 
-# Export to CSV
-output_csv = "forest_cut_matrix.csv"
-matrix_pct.to_csv(output_csv)
-print(f"\nMatrix exported to {output_csv}")
+    print("\n=== MATRIX: Percentage of surface harvested by cut type and forest type ===")
+    print(matrix_pct)
 
-# Create filtered matrix (no Unknown/Unclassified, no Commercial thinning/Others)
-print("\n=== Step 9: Creating filtered probability matrix ===")
+    # Export to CSV
+    output_csv = "forest_cut_matrix.csv"
+    matrix_pct.to_csv(output_csv)
+    print(f"\nMatrix exported to {output_csv}")
 
-# Read the previously exported matrix
-matrix_pct = pd.read_csv("forest_cut_matrix.csv", index_col=0)
-print(f"Loaded matrix from forest_cut_matrix.csv")
+    # Create filtered matrix (no Unknown/Unclassified, no Commercial thinning/Others)
+    print("\n=== Step 9: Creating filtered probability matrix ===")
 
-# Convert percentages back to areas for proper normalization
-total_area = interv_clipped['AREACUT'].sum()
-matrix = (matrix_pct / 100) * total_area
+    # Filter out unwanted columns and rows from the matrix of areas still in memory
+    matrix_filtered = matrix.copy()
 
-# Filter out unwanted columns and rows
-matrix_filtered = matrix.copy()
+    # Remove Unknown/Unclassified column if it exists
+    if 'Unknown/Unclassified' in matrix_filtered.columns:
+        matrix_filtered = matrix_filtered.drop(columns=['Unknown/Unclassified'])
 
-# Remove Unknown/Unclassified column if it exists
-if 'Unknown/Unclassified' in matrix_filtered.columns:
-    matrix_filtered = matrix_filtered.drop(columns=['Unknown/Unclassified'])
+    # Remove Commercial thinning and Others rows if they exist
+    rows_to_remove = ['Commercial thinning', 'Others']
+    for row_name in rows_to_remove:
+        if row_name in matrix_filtered.index:
+            matrix_filtered = matrix_filtered.drop(index=row_name)
 
-# Remove Commercial thinning and Others rows if they exist
-rows_to_remove = ['Commercial thinning', 'Others']
-for row_name in rows_to_remove:
-    if row_name in matrix_filtered.index:
-        matrix_filtered = matrix_filtered.drop(index=row_name)
+    # Convert to probabilities (normalize each column to sum to 1)
+    matrix_prob = matrix_filtered.div(matrix_filtered.sum(axis=0), axis=1)
 
-# Convert to probabilities (normalize each column to sum to 1)
-matrix_prob = matrix_filtered.div(matrix_filtered.sum(axis=0), axis=1)
+    # Handle any NaN values (from columns that sum to 0)
+    matrix_prob = matrix_prob.fillna(0)
 
-# Handle any NaN values (from columns that sum to 0)
-matrix_prob = matrix_prob.fillna(0)
+    # Round to reasonable precision
+    matrix_prob = matrix_prob.round(4)
 
-# Round to reasonable precision
-matrix_prob = matrix_prob.round(4)
+    print("\n=== FILTERED MATRIX: Probabilities by cut type and forest type ===")
+    print(matrix_prob)
+    print(f"\nColumn sums (should all be 1.0): {matrix_prob.sum(axis=0).to_dict()}")
 
-print("\n=== FILTERED MATRIX: Probabilities by cut type and forest type ===")
-print(matrix_prob)
-print(f"\nColumn sums (should all be 1.0): {matrix_prob.sum(axis=0).to_dict()}")
+    # Export to CSV
+    output_csv_prob = "forest_cut_matrix_probabilities.csv"
+    matrix_prob.to_csv(output_csv_prob)
+    print(f"\nFiltered probability matrix exported to {output_csv_prob}")
 
-# Export to CSV
-output_csv_prob = "forest_cut_matrix_probabilities.csv"
-matrix_prob.to_csv(output_csv_prob)
-print(f"\nFiltered probability matrix exported to {output_csv_prob}")
+if __name__ == "__main__":
+    main()
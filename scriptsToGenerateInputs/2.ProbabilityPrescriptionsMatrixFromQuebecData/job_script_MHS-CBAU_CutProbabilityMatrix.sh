@@ -9,7 +9,7 @@
 #SBATCH --time=02-00:00 # time (DD-HH:MM)
 #SBATCH --ntasks=1 # number of MPI processes
 #SBATCH --mem=80GB
-#SBATCH --cpus-per-task=1
+#SBATCH --cpus-per-task=8
 #SBATCH --job-name=MHS-CBAU_CutProbabilityMatrix
 #SBATCH --output=%x-%j.out
 
@@ -26,7 +26,7 @@ cd $SLURM_TMPDIR/
 virtualenv --no-download PythonEnv
 source PythonEnv/bin/activate
 pip install --no-index --upgrade pip
-pip install --no-index pandas numpy fiona geopandas shapely pyogrio tqdm pyarrow
+pip install --no-index pandas numpy geopandas shapely pyogrio tqdm pyarrow
 
 # Launching the scripts
 python -u 3.ComputeFrequencyCutsPerForestTypeMatrix.py
@@ -1,43 +1,73 @@
 import urllib.request
 import zipfile
+import re
 import os
 import sys
 import subprocess
 from pathlib import Path
 
-def progress_hook(block_num, block_size, total_size):
-    downloaded = block_num * block_size
-    percent = min(downloaded * 100 / total_size, 100)
-    sys.stdout.write(f"\rDownloading: {percent:.1f}%")
+# Size of the chunks written to disk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+def progress_hook(name, downloaded, total_size):
+    percent = min(downloaded * 100 / total_size, 100) if total_size else 0
+    sys.stdout.write(f"\rDownloading {name}: {percent:.1f}%")
     sys.stdout.flush()
 
 def download_file(url, destination):
-    """Download a file from URL to destination if it doesn't already exist."""
-    if destination.exists():
-        print(f"File already exists, skipping: {destination.name}")
-        return False
-
-    print(f"Downloading: {url}")
-    urllib.request.urlretrieve(url, destination, reporthook=progress_hook)
-    print(f"Saved to: {destination}")
+    """Download a file from URL to destination if it doesn't already exist.
+    A file left incomplete by an interrupted download is resumed where it stopped."""
+    local_size = destination.stat().st_size if destination.exists() else 0
+    if local_size:
+        # Compare the size of the local file with the one announced by the server
+        with urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=60) as response:
+            remote_size = response.headers.get("Content-Length")
+        if remote_size is None or local_size >= int(remote_size):
+            print(f"File already exists, skipping: {destination.name}")
+            return False
+        print(f"Resuming: {url} (from byte {local_size} of {remote_size})")
+    else:
+        print(f"Downloading: {url}")
+
+    headers = {"Range": f"bytes={local_size}-"} if local_size else {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+        # A server that ignores the range answers 200 with the whole file instead of 206
+        resumed = response.status == 206
+        downloaded = local_size if resumed else 0
+        total_size = downloaded + int(response.headers.get("Content-Length", 0))
+
+        # The response is streamed to the file by large chunks
+        with open(destination, 'ab' if resumed else 'wb') as f:
+            while chunk := response.read(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                downloaded += len(chunk)
+                progress_hook(destination.name, downloaded, total_size)
+    print(f"\nSaved to: {destination}")
     return True
 
-def extract_filtered_zip(zip_path, extract_to, include_string="", exclude_strings=[]):
+def extract_filtered_zip(zip_path, extract_to, include_string="", exclude_strings=()):
     """Extract only files containing include_string and not containing any exclude_strings from zip."""
     print(f"Extracting files containing '{include_string}'...")
+    # A single compiled alternation tests all of the exclude strings at once, in C
+    exclude_pattern = re.compile("|".join(map(re.escape, exclude_strings))) if exclude_strings else None
+
     with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        filtered_files = []
-        for f in zip_ref.namelist():
-            if include_string in f and not any(excl in f for excl in exclude_strings):
-                filtered_files.append(f)
-
-        for file in filtered_files:
-            file_path = extract_to / file
-            if file_path.exists():
-                print(f"  Already exists, skipping: {file}")
+        # Single pass over the central directory to select the members to extract
+        filtered_files = [info for info in zip_ref.infolist()
+                          if include_string in info.filename
+                          and (exclude_pattern is None or not exclude_pattern.search(info.filename))]
+
+        to_extract = []
+        for info in filtered_files:
+            if (extract_to / info.filename).exists():
+                print(f"  Already exists, skipping: {info.filename}")
             else:
-                zip_ref.extract(file, extract_to)
-                print(f"  Extracted: {file}")
+                to_extract.append(info)
+
+        # All remaining members are extracted in one call, with the path sanitizing of zipfile
+        zip_ref.extractall(extract_to, members=to_extract)
+        for info in to_extract:
+            print(f"  Extracted: {info.filename}")
     print(f"Extraction complete.")
 
 def main():
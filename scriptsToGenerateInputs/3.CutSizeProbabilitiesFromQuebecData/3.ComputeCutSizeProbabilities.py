@@ -3,18 +3,34 @@
 # the more limited cut categories found the datasets of the National Forestry Database of Canada
 
 # %% Imports and Configuration
-import fiona
 import json
 import matplotlib.pyplot as plt
 import numpy as np
-from collections import defaultdict
-from scipy import stats
-from tqdm import tqdm
+import pandas as pd
+import pyogrio
+from scipy import ndimage
 
 # Configuration
 GDB_PATH = r"./InputData/INTERV_FORES_PROV.gdb"
 JSON_PATH = "./InputData/CutTypeCategories.json"
 OUTPUT_JSON = "cutSizesDistribution.json"
+# Set to False to only compute the statistics, without drawing the figures of each category
+PLOT = True
+# Number of bins on which the samples are gathered to compute the KDE of the figures
+KDE_GRID_SIZE = 4096
+
+# %% KDE Function
+def binned_gaussian_kde(samples, x_range):
+    """Gaussian KDE of samples evaluated at x_range, with the same bandwidth (Scott's rule) as scipy's gaussian_kde.
+    The samples are gathered in a fine histogram that is then smoothed by a Gaussian filter, which costs
+    O(N + M) instead of the O(N * M) sum of gaussian_kde over all samples and evaluation points."""
+    bandwidth = samples.std(ddof=1) * len(samples) ** (-1 / 5)
+    counts, edges = np.histogram(samples, bins=KDE_GRID_SIZE,
+                                 range=(samples.min() - 4 * bandwidth, samples.max() + 4 * bandwidth))
+    bin_width = edges[1] - edges[0]
+    density = ndimage.gaussian_filter1d(counts.astype(np.float64), bandwidth / bin_width, mode='constant')
+    density /= len(samples) * bin_width
+    return np.interp(x_range, edges[:-1] + bin_width / 2, density)
 
 # %% Load Reclassification Dictionary
 with open(JSON_PATH, 'r', encoding='utf-8') as f:
@@ -23,39 +39,29 @@ with open(JSON_PATH, 'r', encoding='utf-8') as f:
 print(f"Loaded {len(reclass_dict)} reclassification codes")
 
 # %% Read Data from GDB
-data = []
-with fiona.open(GDB_PATH, layer=0) as src:
-    total_features = len(src)
-    print(f"Loading {total_features} features...")
+# Only the three attribute columns are read, directly into a DataFrame, without the geometries
+df = pyogrio.read_dataframe(GDB_PATH, layer=0, columns=['ORIGINE', 'PERTURB', 'SUPERFICIE'],
+                            read_geometry=False, use_arrow=True)
 
-    for feature in tqdm(src, total=total_features, desc="Reading polygons"):
-        props = feature['properties']
-        data.append({
-            'ORIGINE': props.get('ORIGINE', ''),
-            'PERTURB': props.get('PERTURB', ''),
-            'SUPERFICIE': props.get('SUPERFICIE', 0)
-        })
-
-print(f"Loaded {len(data)} records")
+print(f"Loaded {len(df)} records")
 
 # %% Create and Reclassify CUTTYPE
-# Create CUTTYPE attribute
-for record in data:
-    record['CUTTYPE'] = record['PERTURB'] if record['PERTURB'] else record['ORIGINE']
+# Create CUTTYPE attribute (PERTURB when there is one, ORIGINE otherwise)
+perturb = df['PERTURB'].fillna('')
+cuttype = perturb.where(perturb != '', df['ORIGINE'])
 
-# Reclassify CUTTYPE using dictionary
-for record in data:
-    code = record['CUTTYPE']
-    if code in reclass_dict and 'english_category' in reclass_dict[code]:
-        record['CUTTYPE'] = reclass_dict[code]['english_category']
+# Reclassify CUTTYPE using dictionary; the codes without an english category are kept as they are
+reclass_map = {code: values['english_category'] for code, values in reclass_dict.items()
+               if 'english_category' in values}
+df['CUTTYPE'] = cuttype.map(reclass_map).fillna(cuttype).astype('category')
 
 print("CUTTYPE created and reclassified")
 
 # %% Group Data by Cut Category
-categories = defaultdict(list)
-for record in data:
-    if record['SUPERFICIE'] > 0:  # Filter out zero or invalid areas
-        categories[record['CUTTYPE']].append(record['SUPERFICIE'])
+# Filter out zero or invalid areas, then gather the surfaces of each category as a contiguous array
+df = df.loc[df['SUPERFICIE'].to_numpy() > 0]
+categories = {category: surfaces.to_numpy(dtype=np.float64)
+              for category, surfaces in df.groupby('CUTTYPE', observed=True)['SUPERFICIE']}
 
 print(f"Found {len(categories)} cut categories")
 
@@ -66,12 +72,12 @@ for category, surfaces in categories.items():
     if len(surfaces) < 2:
         continue
 
-    surfaces = np.array(surfaces)
     n_polygons = len(surfaces)
 
-    # Create percentile-based bins (each bin ≈ 1% of polygons)
-    percentiles = np.linspace(0, 100, 101)  # 0, 1, 2, ..., 100
-    bins = np.percentile(surfaces, percentiles)
+    # Create percentile-based bins (each bin ≈ 1% of polygons), taken directly from the sorted surfaces
+    sorted_surfaces = np.sort(surfaces)
+    percentile_idx = np.linspace(0, n_polygons - 1, 101).astype(np.int64)  # 0, 1, 2, ..., 100 %
+    bins = sorted_surfaces[percentile_idx]
 
     # Remove duplicate bin edges (can occur if many identical values)
     bins = np.unique(bins)
@@ -79,8 +85,11 @@ for category, surfaces in categories.items():
 
     bin_upper_bounds = bins[1:].tolist()
 
-    # Calculate actual frequencies
-    hist, _ = np.histogram(surfaces, bins=bins)
+    # Calculate actual frequencies : the position of each bin edge in the sorted surfaces gives the number of
+    # surfaces before it. As with np.histogram, the last bin also includes its upper edge (the maximum).
+    edge_positions = np.searchsorted(sorted_surfaces, bins, side='left')
+    edge_positions[-1] = n_polygons
+    hist = np.diff(edge_positions)
     probabilities = (hist / n_polygons * 100).tolist()
 
     # Store in output dictionary
@@ -91,29 +100,30 @@ for category, surfaces in categories.items():
         'n_polygons': n_polygons
     }
 
-    # Create visualization
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
-
-    # Histogram with percentile bins
-    ax1.hist(surfaces, bins=bins, alpha=0.7, edgecolor='black')
-    ax1.set_xlabel('Surface Area (ha)')
-    ax1.set_ylabel('Frequency')
-    ax1.set_title(f'{category} - Histogram ({n_bins} bins)')
-    ax1.grid(alpha=0.3)
-
-    # KDE
-    kde = stats.gaussian_kde(surfaces)
-    x_range = np.linspace(surfaces.min(), surfaces.max(), 500)
-    ax2.plot(x_range, kde(x_range), linewidth=2)
-    ax2.fill_between(x_range, kde(x_range), alpha=0.3)
-    ax2.set_xlabel('Surface Area (ha)')
-    ax2.set_ylabel('Density')
-    ax2.set_title(f'{category} - KDE')
-    ax2.grid(alpha=0.3)
-
-    plt.tight_layout()
-    plt.savefig(f'{category.replace(" ", "_")}_distribution.png', dpi=300, bbox_inches='tight')
-    plt.close()
+    if PLOT:
+        # Create visualization
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+
+        # Histogram with percentile bins, drawn from the counts computed above instead of binning the surfaces again
+        ax1.hist(bins[:-1], bins=bins, weights=hist, alpha=0.7, edgecolor='black')
+        ax1.set_xlabel('Surface Area (ha)')
+        ax1.set_ylabel('Frequency')
+        ax1.set_title(f'{category} - Histogram ({n_bins} bins)')
+        ax1.grid(alpha=0.3)
+
+        # KDE
+        x_range = np.linspace(surfaces.min(), surfaces.max(), 500)
+        density = binned_gaussian_kde(surfaces, x_range)
+        ax2.plot(x_range, density, linewidth=2)
+        ax2.fill_between(x_range, density, alpha=0.3)
+        ax2.set_xlabel('Surface Area (ha)')
+        ax2.set_ylabel('Density')
+        ax2.set_title(f'{category} - KDE')
+        ax2.grid(alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(f'{category.replace(" ", "_")}_distribution.png', dpi=300, bbox_inches='tight')
+        plt.close()
 
     print(f"Processed {category}: {n_polygons} cuts, {n_bins} bins")
 
@@ -20,8 +20,9 @@ def extract_filtered_zip(zip_path, extract_to, include_string, exclude_strings):
             if include_string in f and not any(excl in f for excl in exclude_strings):
                 filtered_files.append(f)
 
+        # All members are extracted in one call instead of one extract() call per member
+        zip_ref.extractall(extract_to, members=filtered_files)
         for file in filtered_files:
-            zip_ref.extract(file, extract_to)
             print(f"  Extracted: {file}")
     print(f"Extraction complete. {len(filtered_files)} files extracted.")
 
@@ -48,15 +49,22 @@ def main():
     subprocess.run([str(python_path), "-m", "pip", "install", "--upgrade", "pip"], check=True)
 
     # Install packages
-    packages = ["pandas", "geopandas", "shapely", "numpy", "requests", "tqdm", "gdal-installer", "rasterio"]
+    packages = ["pandas", "geopandas", "shapely", "numpy", "requests", "tqdm", "orjson", "gdal-installer", "rasterio"]
 
-    for package in packages:
-        print(f"Installing {package}...")
-        subprocess.run([str(python_path), "-m", "pip", "install", package], check=True)
+    # All of the packages are installed with a single pip call, so that the dependencies are resolved
+    # only once; --no-compile skips the .pyc generation (done on first import anyway)
+    print(f"Installing {', '.join(packages)}...")
+    subprocess.run([str(python_path), "-m", "pip", "install", "--no-compile", "--prefer-binary", *packages], check=True)
         
-    # Finish by installing gdal-installer
-    print(f"Preactivating python environment and installing GDAL...")
-    subprocess.run("cd PythonEnv/Scripts && activate.bat && install-gdal.exe", shell=True)
+    # Finish by installing GDAL with gdal-installer. Activating the environment only sets VIRTUAL_ENV
+    # and puts its Scripts folder first in the PATH, so this is done directly in the environment
+    # variables of install-gdal.exe, without going through cmd.exe and activate.bat
+    print(f"Installing GDAL in the python environment...")
+    scripts_dir = python_env_dir / "Scripts"
+    env = os.environ.copy()
+    env["PATH"] = str(scripts_dir) + os.pathsep + env.get("PATH", "")
+    env["VIRTUAL_ENV"] = str(python_env_dir)
+    subprocess.run([str(scripts_dir / "install-gdal.exe")], env=env, cwd=scripts_dir, check=True)
 
     print("\n=== Setup Complete ===")
     print(f"Python environment created at: {python_env_dir}")
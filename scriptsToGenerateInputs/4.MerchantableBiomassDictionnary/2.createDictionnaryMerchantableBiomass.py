@@ -1,15 +1,18 @@
 import os
-import json
+import orjson
 import zipfile
 import requests
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import shape, Polygon, MultiPolygon
 from shapely.strtree import STRtree
+import shapely
 import numpy as np
 from io import BytesIO
 from tqdm import tqdm
 import glob
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import rasterio
 from rasterio.features import rasterize
 
@@ -30,40 +33,39 @@ PROVINCE_CODES = {
     'Nunavut': 'NU'
 }
 
+# Size of the chunks written to disk when streaming a download
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+def download_file(url, filename):
+    """Download a file from URL, streaming it to disk chunk by chunk instead of holding it in memory"""
+    with requests.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(filename, 'wb') as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+
 print("Starting script...")
 
-# Download provinces shapefile
-print("\n1. Downloading provinces shapefile...")
+# Download provinces shapefile, ecozones GeoJSON and CSV parameters
+# The three downloads are independent and bound by the network (the GIL is released during socket reads) :
+# they are done concurrently in threads.
+print("\n1-3. Downloading provinces shapefile, ecozones GeoJSON and equation parameters CSV...")
 provinces_url = "https://naciscdn.org/naturalearth/5.1.2/50m/cultural/50m_cultural.zip"
 provinces_zip = "50m_cultural.zip"
-
-response = requests.get(provinces_url)
-with open(provinces_zip, 'wb') as f:
-    f.write(response.content)
-
-with zipfile.ZipFile(provinces_zip, 'r') as zip_ref:
-    zip_ref.extractall("provinces_data")
-print("Provinces shapefile downloaded and extracted.")
-
-# Download ecozones GeoJSON
-print("\n2. Downloading ecozones GeoJSON...")
 ecozones_url = "https://agriculture.canada.ca/atlas/data_donnees/nationalEcologicalFramework/data_donnees/geoJSON/ez/nef_ca_ter_ecozone_v2_2.geojson"
 ecozones_file = "ecozones.geojson"
-
-response = requests.get(ecozones_url)
-with open(ecozones_file, 'wb') as f:
-    f.write(response.content)
-print("Ecozones GeoJSON downloaded.")
-
-# Download CSV parameters
-print("\n3. Downloading equation parameters CSV...")
 csv_url = "https://nfi.nfis.org/resources/biomass_models/appendix2_table6_tb.csv"
 csv_file = "appendix2_table6_tb.csv"
 
-response = requests.get(csv_url)
-with open(csv_file, 'wb') as f:
-    f.write(response.content)
-print("CSV parameters downloaded.")
+downloads = [(provinces_url, provinces_zip), (ecozones_url, ecozones_file), (csv_url, csv_file)]
+with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+    # Consuming the results re-raises the exception of a failed download
+    list(executor.map(lambda download: download_file(*download), downloads))
+print("Provinces shapefile, ecozones GeoJSON and CSV parameters downloaded.")
+
+with zipfile.ZipFile(provinces_zip, 'r') as zip_ref:
+    zip_ref.extractall("provinces_data")
+print("Provinces shapefile extracted.")
 
 # Load spatial datasets
 print("\n4. Loading spatial datasets...")
@@ -82,62 +84,99 @@ provinces_gdf['JURIS_ID'] = provinces_gdf['postal']
 
 # Intersect provinces and ecozones
 print("\n7. Intersecting provinces and ecozones (this may take a while)...")
-intersected_gdf = gpd.overlay(provinces_gdf, ecozones_gdf, how='intersection')
-intersected_gdf = intersected_gdf[['JURIS_ID', 'ECOZONE_ID', 'geometry']]
-intersected_gdf = intersected_gdf[intersected_gdf.geometry.is_valid]
+# The intersecting province-ecozone pairs are found with a spatial join (a single STRtree query), and only their
+# intersections are computed, in one vectorized call. The pairs are sorted by province and then ecozone, as with overlay.
+provinces_gdf = provinces_gdf[['JURIS_ID', 'geometry']].reset_index(drop=True)
+ecozones_gdf = ecozones_gdf[['ECOZONE_ID', 'geometry']].reset_index(drop=True)
+
+# As overlay does by default, the invalid polygons of both layers are repaired first : GEOS predicates and
+# intersections can fail (TopologyException) or give wrong results on them
+for layer_gdf in (provinces_gdf, ecozones_gdf):
+    invalid = ~layer_gdf.geometry.is_valid.to_numpy()
+    if invalid.any():
+        print(f"Repairing {invalid.sum()} invalid geometries...")
+        layer_gdf.loc[invalid, 'geometry'] = shapely.make_valid(layer_gdf.geometry.to_numpy()[invalid])
+
+pairs = gpd.sjoin(provinces_gdf, ecozones_gdf, how='inner', predicate='intersects')
+province_idx = pairs.index.to_numpy()
+ecozone_idx = pairs['index_right'].to_numpy()
+pair_order = np.lexsort((ecozone_idx, province_idx))
+province_idx, ecozone_idx = province_idx[pair_order], ecozone_idx[pair_order]
+intersections = shapely.intersection(provinces_gdf.geometry.to_numpy()[province_idx],
+                                     ecozones_gdf.geometry.to_numpy()[ecozone_idx])
+
+# Like overlay, we only keep the polygonal parts of the intersections : the polygons of geometry collections
+# are dissolved together (they can touch along shared edges, so they are unioned rather than gathered in a
+# multipolygon, which would be invalid), and the lines or points of bordering pairs are dropped
+for position in np.flatnonzero(shapely.get_type_id(intersections) == 7):
+    parts = shapely.get_parts(intersections[position])
+    intersections[position] = shapely.union_all(parts[np.isin(shapely.get_type_id(parts), [3, 6])])
+polygonal = np.isin(shapely.get_type_id(intersections), [3, 6]) & ~shapely.is_empty(intersections)
+
+intersected_gdf = gpd.GeoDataFrame({'JURIS_ID': provinces_gdf['JURIS_ID'].to_numpy()[province_idx][polygonal],
+                                    'ECOZONE_ID': ecozones_gdf['ECOZONE_ID'].to_numpy()[ecozone_idx][polygonal]},
+                                   geometry=intersections[polygonal], crs=provinces_gdf.crs)
+valid = intersected_gdf.geometry.is_valid
+if not valid.all():
+    print(f"WARNING : Dropping {(~valid).sum()} invalid province-ecozone intersection polygons "
+          f"({intersected_gdf.geometry[~valid].area.sum():.2f} of area in the units of the CRS).")
+intersected_gdf = intersected_gdf[valid]
 print(f"Created {len(intersected_gdf)} province-ecozone intersection polygons.")
 
-# Load CSV with parameters
-print("\n8. Loading equation parameters from CSV...")
-params_df = pd.read_csv(csv_file)
-params_df['species_fullname'] = params_df['genus'] + '.' + params_df['species']
-print(f"Loaded {len(params_df)} parameter rows for {params_df['species_fullname'].nunique()} unique species.")
-
-# Get unique combinations
-unique_species = params_df['species_fullname'].unique()
-unique_combos = intersected_gdf[['JURIS_ID', 'ECOZONE_ID']].drop_duplicates()
-print(f"\n9. Creating dictionary structure with {len(unique_combos)} unique province-ecozone combinations.")
-
-
-# Pre-compute all border-to-border distances between polygons
-print("\n12. Pre-computing distances between all polygon pairs...")
-n_polygons = len(intersected_gdf)
-distance_dict = {}
-
-# Create list of geometries and keys for faster access
-geom_list = []
-key_list = []
-for idx, row in intersected_gdf.iterrows():
-    geom_list.append(row.geometry)
-    key_list.append(f"{row['JURIS_ID']}-{row['ECOZONE_ID']}")
-
-# Calculate distances with progress bar
-total_pairs = n_polygons * (n_polygons - 1) // 2
-print(f"Computing {total_pairs} distance pairs for {n_polygons} polygons...")
-
-with tqdm(total=total_pairs, desc="Computing distances") as pbar:
-    for i in range(n_polygons):
-        geom_i = geom_list[i]
-        key_i = key_list[i]
-
-        for j in range(i + 1, n_polygons):
-            geom_j = geom_list[j]
-            key_j = key_list[j]
-
-            # Calculate distance
-            dist = geom_i.distance(geom_j)
-
-            # Store in both directions for easy lookup
-            distance_dict[(key_i, key_j)] = dist
-            distance_dict[(key_j, key_i)] = dist
-
-            pbar.update(1)
-
-print(f"Distance computation complete. Stored {len(distance_dict)} distance pairs.")
+# Index the polygons by province-ecozone combination; the border-to-border distances are only computed
+# when a substitution needs them, between the target combination and the combinations available for the species
+print("\n12. Indexing polygons by province-ecozone combination...")
+geom_list = intersected_gdf.geometry.to_numpy()
+key_list = np.array([f"{juris}-{ecozone}" for juris, ecozone in zip(intersected_gdf['JURIS_ID'], intersected_gdf['ECOZONE_ID'])])
+geom_bounds = shapely.bounds(geom_list)
+
+# Species often have the same available combinations : the result is cached for each target and (ordered) tuple of
+# available combinations, so that the distances are only computed once per distinct query
+@lru_cache(maxsize=None)
+def closest_available_combo(target_key, available_keys):
+    """Returns the position in available_keys (a tuple) of the combination closest (border to border) to target_key,
+    or None if none of them has polygons. In case of ties, the first one in available_keys is returned."""
+    target_polygons = np.flatnonzero(key_list == target_key)
+    avail_polygons = np.flatnonzero(np.isin(key_list, available_keys))
+    if len(target_polygons) == 0 or len(avail_polygons) == 0:
+        return None
+
+    # Lower bounds of the distances between the target polygons (rows) and the available polygons (columns) :
+    # the distances between their bounding boxes, computed for all pairs at once with NumPy
+    target_bounds = geom_bounds[target_polygons][:, np.newaxis, :]
+    avail_bounds = geom_bounds[avail_polygons][np.newaxis, :, :]
+    gap_x = np.maximum(0, np.maximum(avail_bounds[..., 0] - target_bounds[..., 2], target_bounds[..., 0] - avail_bounds[..., 2]))
+    gap_y = np.maximum(0, np.maximum(avail_bounds[..., 1] - target_bounds[..., 3], target_bounds[..., 1] - avail_bounds[..., 3]))
+    lower_bounds = np.hypot(gap_x, gap_y)
+
+    # The exact distance of the pair with the smallest lower bound is an upper bound of the minimum distance :
+    # only the pairs whose lower bound doesn't exceed it can be at the minimum (or tied with it), so the exact
+    # (and costly) border-to-border distance is only computed for them, in a single vectorized GEOS call
+    closest_row, closest_column = np.unravel_index(np.argmin(lower_bounds), lower_bounds.shape)
+    upper_bound = shapely.distance(geom_list[target_polygons[closest_row]], geom_list[avail_polygons[closest_column]])
+    candidate_rows, candidate_columns = np.nonzero(lower_bounds <= upper_bound)
+    pair_distances = np.full(lower_bounds.shape, np.inf)
+    pair_distances[candidate_rows, candidate_columns] = shapely.distance(geom_list[target_polygons[candidate_rows]],
+                                                                         geom_list[avail_polygons[candidate_columns]])
+    distances = pair_distances.min(axis=0)
+
+    # Distance to each available combination (the closest of its polygons)
+    key_positions = {key: position for position, key in enumerate(available_keys)}
+    combo_distances = np.full(len(available_keys), np.inf)
+    np.minimum.at(combo_distances, [key_positions[key] for key in key_list[avail_polygons]], distances)
+    return int(np.argmin(combo_distances))
 
 # Load CSV with parameters and clean column names
 print("\n13. Loading equation parameters from CSV...")
-params_df = pd.read_csv(csv_file)
+# Only the columns that are used are parsed, with explicit types. The parameters stay in float64
+# so that the ratios are unchanged, and juris_id stays a string as it is joined with the province codes.
+# The column names of the CSV have leading/trailing spaces, so we read its header first to find them.
+params_columns = {name.strip(): name for name in pd.read_csv(csv_file, nrows=0).columns}
+params_dtypes = {'genus': str, 'species': str, 'variety': str, 'juris_id': str, 'ecozone': np.float64,
+                 **{param: np.float64 for param in ['a1', 'a2', 'a3', 'b1', 'b2', 'b3', 'c1', 'c2', 'c3']}}
+used_columns = [name for name in params_columns if name in params_dtypes or name == 'canfi_spec']
+params_df = pd.read_csv(csv_file, usecols=[params_columns[name] for name in used_columns],
+                        dtype={params_columns[name]: params_dtypes[name] for name in used_columns if name in params_dtypes})
 
 # Clean column names (remove leading/trailing spaces)
 params_df.columns = params_df.columns.str.strip()
@@ -163,30 +202,17 @@ print(f"\n14. Creating dictionary structure with {len(unique_combos)} unique pro
 
 # We prepare the dictionnary of unique province/ecozones combo ID
 # Starts at 1, and goes up to the max number of combos
+combos_arr = [(juris, int(ecozone)) for juris, ecozone in unique_combos[['JURIS_ID', 'ECOZONE_ID']].to_numpy()]
 comboCodes_dict = {}
-comboCode = 1
-for _, row in unique_combos.iterrows():
-    juris = row['JURIS_ID']
-    ecozone = int(row['ECOZONE_ID'])
-    if juris not in comboCodes_dict:
-        comboCodes_dict[juris] = dict()
-    comboCodes_dict[juris][ecozone] = comboCode
-    comboCode += 1
-
-# Initialize dictionary of ratios
-ratio_dict = {}
-for species in unique_species:
-    ratio_dict[species] = {}
-    for _, row in unique_combos.iterrows():
-        juris = row['JURIS_ID']
-        ecozone = int(row['ECOZONE_ID'])
-        if comboCodes_dict[juris][ecozone] not in ratio_dict[species]:
-            ratio_dict[species][comboCodes_dict[juris][ecozone]] = {
-                'substitution': None,
-                'ratio': None,
-                'province': juris,
-                'ecozone_id' : ecozone
-            }
+for comboCode, (juris, ecozone) in enumerate(combos_arr, start=1):
+    comboCodes_dict.setdefault(juris, {})[ecozone] = comboCode
+
+# Initialize the table of ratios : one row per species, one column per combo (in the order of the combo codes).
+# The ratios and their substitution notes are kept in dense arrays while they are computed,
+# and only converted to the dictionnary of ratios when it is exported.
+combo_codes = [comboCodes_dict[juris][ecozone] for juris, ecozone in combos_arr]
+ratios = np.full((len(unique_species), len(combos_arr)), np.nan)
+substitution_notes = np.full(ratios.shape, None, dtype=object)
 
 # Initialize dictionary of ratios - outdated
 # ratio_dict = {}
@@ -202,138 +228,119 @@ for species in unique_species:
             # 'ratio': None
         # }
 
-# Function to calculate ratio
-def calculate_ratio(params, aboveground_biomass=100):
-    a = params['a1'] + params['a2'] * aboveground_biomass + params['a3'] * np.log(aboveground_biomass)
-    b = params['b1'] + params['b2'] * aboveground_biomass + params['b3'] * np.log(aboveground_biomass)
-    c = params['c1'] + params['c2'] * aboveground_biomass + params['c3'] * np.log(aboveground_biomass)
-    ratio = 1 / (1 + np.exp(a) + np.exp(b) + np.exp(c))
-    return ratio
+# Function to calculate the ratios of an array of parameters, with one row of a1, a2, a3, b1, b2, b3, c1, c2, c3 per ratio.
+# The logistic equations are evaluated for all rows at once, as NumPy array operations.
+def calculate_ratios(params, aboveground_biomass=100.0):
+    params = np.asarray(params, dtype=np.float64).reshape(-1, 9)
+    log_biomass = np.log(aboveground_biomass)
+    # Exponentials of a, b and c (one column each), computed in one array operation
+    exp_abc = np.exp(params[:, 0::3] + params[:, 1::3] * aboveground_biomass + params[:, 2::3] * log_biomass)
+    return 1.0 / (1.0 + exp_abc[:, 0] + exp_abc[:, 1] + exp_abc[:, 2])
 
 # Fill dictionary
 print("\n15. Filling dictionary with ratios...")
-total_entries = len(unique_species) * len(unique_combos)
-substitutions = 0
-
-with tqdm(total=total_entries, desc="Processing entries") as pbar:
-    for species in unique_species:
-        # Get available combos for this species
-        species_params = params_df[params_df['species_fullname'] == species]
-
-        for _, combo_row in unique_combos.iterrows():
-            juris = combo_row['JURIS_ID']
-            ecozone = int(combo_row['ECOZONE_ID'])
-
-            # Check if parameters exist
-            matching_params = species_params[
-                (species_params['juris_id'] == juris) & 
-                (species_params['ecozone'] == ecozone)
-            ]
-
-            if len(matching_params) > 1:
-                # Check if all duplicate rows are identical
-                param_cols = ['a1', 'a2', 'a3', 'b1', 'b2', 'b3', 'c1', 'c2', 'c3']
-                first_row = matching_params.iloc[0][param_cols]
-                all_identical = all(
-                    matching_params.iloc[i][param_cols].equals(first_row) 
-                    for i in range(1, len(matching_params))
-                )
-
-                if not all_identical:
-                    # Check if canfi_spec values are different
-                    canfi_spec_values = matching_params['canfi_spec'].unique()
-                    if len(canfi_spec_values) > 1:
-                        # Different canfi_spec values, use first row
-                        params_row = matching_params.iloc[0]
-                    else:
-                        # Same canfi_spec but different parameters - this is an error
-                        raise ValueError(f"Multiple non-identical parameter rows found for {species}, {juris}, {ecozone} with same canfi_spec")
-                else:
-                    # Use first row if all are identical
-                    params_row = matching_params.iloc[0]
-            elif len(matching_params) == 1:
-                params_row = matching_params.iloc[0]
-            else:
-                params_row = None
-
-            if params_row is not None:
-                # Direct match found
-                ratio = calculate_ratio(params_row)
-                ratio_dict[species][comboCodes_dict[juris][ecozone]]['ratio'] = float(ratio)
-                ratio_dict[species][comboCodes_dict[juris][ecozone]]['substitution'] = 'none'
-            else:
-                # Need substitution
-                substitutions += 1
-
-                # Find available combos for this species
-                available_combos = species_params[['juris_id', 'ecozone']].drop_duplicates()
-
-                if len(available_combos) == 0:
-                    # No parameters available for this species at all
-                    ratio_dict[species][comboCodes_dict[juris][ecozone]]['ratio'] = None
-                    ratio_dict[species][comboCodes_dict[juris][ecozone]]['substitution'] = 'no_data_available'
-                else:
-                    # Find closest polygon using pre-computed distances
-                    target_key = f"{juris}-{ecozone}"
-                    min_distance = float('inf')
-                    closest_juris = None
-                    closest_ecozone = None
-
-                    for _, avail_row in available_combos.iterrows():
-                        avail_juris = avail_row['juris_id']
-                        avail_ecozone = int(avail_row['ecozone'])
-                        avail_key = f"{avail_juris}-{avail_ecozone}"
-
-                        # Look up pre-computed distance
-                        dist_key = (target_key, avail_key)
-                        if dist_key in distance_dict:
-                            dist = distance_dict[dist_key]
-                            if dist < min_distance:
-                                min_distance = dist
-                                closest_juris = avail_juris
-                                closest_ecozone = avail_ecozone
-
-                    if closest_juris is not None:
-                        # Get parameters and calculate ratio
-                        substitute_params = species_params[
-                            (species_params['juris_id'] == closest_juris) & 
-                            (species_params['ecozone'] == closest_ecozone)
-                        ].iloc[0]
-
-                        ratio = calculate_ratio(substitute_params)
-                        ratio_dict[species][comboCodes_dict[juris][ecozone]]['ratio'] = float(ratio)
-                        ratio_dict[species][comboCodes_dict[juris][ecozone]]['substitution'] = f'Substituted with {closest_juris}-{closest_ecozone}'
-                    else:
-                        ratio_dict[species][comboCodes_dict[juris][ecozone]]['ratio'] = None
-                        ratio_dict[species][comboCodes_dict[juris][ecozone]]['substitution'] = 'no_data_available'
-
-            pbar.update(1)
+param_cols = ['a1', 'a2', 'a3', 'b1', 'b2', 'b3', 'c1', 'c2', 'c3']
+key_cols = ['species_fullname', 'juris_id', 'ecozone']
+
+# Parameters used for each species-province-ecozone combination : the first row of the CSV
+first_params = params_df.drop_duplicates(key_cols)[key_cols + param_cols]
+
+# All species x province-ecozone combinations, joined to their parameters in a single merge
+combos_df = pd.DataFrame({'juris_id': unique_combos['JURIS_ID'].to_numpy(),
+                          'ecozone_id': unique_combos['ECOZONE_ID'].to_numpy().astype(int)})
+combos_df['ecozone'] = combos_df['ecozone_id'].astype(params_df['ecozone'].dtype)
+cells = pd.DataFrame({'species_fullname': unique_species}).merge(combos_df, how='cross')
+cells = cells.merge(first_params, on=key_cols, how='left', indicator=True)
+# A missing species name never matches parameters (as with the == comparisons it replaces, unlike merge)
+matched = ((cells['_merge'] == 'both') & cells['species_fullname'].notna()).to_numpy()
+
+# Duplicated rows for a combination must have identical parameters, unless they have different canfi_spec values
+# The identical rows are removed by hashing, so that only the combinations with several distinct rows remain to be checked
+distinct_params = params_df.drop_duplicates(key_cols + param_cols)
+conflicting_keys = distinct_params.loc[distinct_params.duplicated(key_cols, keep=False), key_cols].drop_duplicates()
+n_canfi_spec = params_df.merge(conflicting_keys, on=key_cols).groupby(key_cols)['canfi_spec'].nunique(dropna=False)
+conflicts = n_canfi_spec[n_canfi_spec <= 1].reset_index()[key_cols]
+conflicts = conflicts.merge(cells.loc[matched, key_cols + ['ecozone_id']], on=key_cols)
+if len(conflicts) > 0:
+    species, juris, ecozone = conflicts.iloc[0][['species_fullname', 'juris_id', 'ecozone_id']]
+    raise ValueError(f"Multiple non-identical parameter rows found for {species}, {juris}, {ecozone} with same canfi_spec")
+
+# Direct matches : all of their ratios are computed at once (the cells are ordered by species, then combo)
+matched_table = matched.reshape(ratios.shape)
+ratios[matched_table] = calculate_ratios(cells.loc[matched, param_cols].to_numpy(dtype=np.float64))
+substitution_notes[matched_table] = 'none'
+
+# Combinations available for each species, in the order of the CSV
+available_by_species = {}
+for species, species_combos in first_params.groupby('species_fullname', sort=False):
+    available_juris = species_combos['juris_id'].tolist()
+    available_ecozones = species_combos['ecozone'].tolist()
+    available_keys = tuple(f"{avail_juris}-{int(avail_ecozone)}"
+                           for avail_juris, avail_ecozone in zip(available_juris, available_ecozones))
+    available_by_species[species] = (available_juris, available_ecozones, available_keys)
+
+# Need substitution : we find the closest available combo of each missing combination,
+# and then compute the ratios of all of the substitutes at once
+species_rows, combo_columns = np.nonzero(~matched_table)
+substitutions = len(species_rows)
+substitutes = []
+for species_row, combo_column in tqdm(zip(species_rows.tolist(), combo_columns.tolist()),
+                                      total=substitutions, desc="Processing substitutions"):
+    species = unique_species[species_row]
+    juris, ecozone = combos_arr[combo_column]
+    # A species without any available combo (e.g. a missing species name, dropped by the groupby) has no data
+    available_juris, available_ecozones, available_keys = available_by_species.get(species, ([], [], ()))
+    closest = closest_available_combo(f"{juris}-{ecozone}", available_keys) if available_keys else None
+    if closest is None:
+        substitution_notes[species_row, combo_column] = 'no_data_available'
+    else:
+        substitutes.append((species_row, combo_column, species, available_juris[closest], available_ecozones[closest]))
+
+if substitutes:
+    substitutes_df = pd.DataFrame(substitutes, columns=['species_row', 'combo_column', 'species_fullname', 'juris_id', 'ecozone'])
+    substitutes_df = substitutes_df.merge(first_params, on=key_cols, how='left')
+    substitute_cells = (substitutes_df['species_row'].to_numpy(), substitutes_df['combo_column'].to_numpy())
+    ratios[substitute_cells] = calculate_ratios(substitutes_df[param_cols].to_numpy(dtype=np.float64))
+    substitution_notes[substitute_cells] = [f'Substituted with {closest_juris}-{int(closest_ecozone)}'
+                                            for closest_juris, closest_ecozone in zip(substitutes_df['juris_id'], substitutes_df['ecozone'])]
 
 print(f"\nCompleted processing. Total substitutions made: {substitutions}")
 
 # Fix ALNU species with problematic small ratios
 print("\n15b. Fixing ALNU species with problematic small ratios...")
-alnu_species = [sp for sp in ratio_dict.keys() if sp.startswith('ALNU.')]
-fixed_count = 0
+alnu_species = np.array([isinstance(species, str) and species.startswith('ALNU.') for species in unique_species], dtype=bool)
 
-for species in alnu_species:
-    for comboCodeProvEcozone in ratio_dict[species]:
-        current_ratio = ratio_dict[species][comboCodeProvEcozone]['ratio']
+# Check if ratio is too small (< 0.001), for all combos of the ALNU species at once (missing ratios are NaN, and never match)
+too_small = alnu_species[:, np.newaxis] & (ratios < 0.001)
 
-        # Check if ratio is too small (< 0.001)
-        if current_ratio is not None and current_ratio < 0.001:
-            # Replace with BC-4 ratio
-            ratio_dict[species][comboCodeProvEcozone]['ratio'] = 0.6174823234548655
-            ratio_dict[species][comboCodeProvEcozone]['substitution'] = 'Replacement of ratios that were too small due to problematic parameters (see ALNU SPP for QC 6 in the .csv for an example); only 5 trees were available for these parameters. Substituted for BC-4.'
-            fixed_count += 1
+# Replace with BC-4 ratio
+ratios[too_small] = 0.6174823234548655
+substitution_notes[too_small] = 'Replacement of ratios that were too small due to problematic parameters (see ALNU SPP for QC 6 in the .csv for an example); only 5 trees were available for these parameters. Substituted for BC-4.'
+fixed_count = int(too_small.sum())
 
 print(f"Fixed {fixed_count} ALNU entries with ratios < 0.001")
 
+# Dictionnary of ratios, built from the table (a missing ratio is None)
+ratio_dict = {
+    species: {
+        code: {
+            'substitution': substitution_notes[species_row, combo_column],
+            'ratio': None if np.isnan(ratios[species_row, combo_column]) else float(ratios[species_row, combo_column]),
+            'province': juris,
+            'ecozone_id': ecozone
+        }
+        for combo_column, (code, (juris, ecozone)) in enumerate(zip(combo_codes, combos_arr))
+    }
+    for species_row, species in enumerate(unique_species)
+}
+
 # Export to JSON
 print("\n16. Exporting dictionary to JSON...")
 output_file = "merchantableBiomassRatiosDictionnary.json"
-with open(output_file, 'w') as f:
-    json.dump(ratio_dict, f, indent=2)
+# orjson serializes the dictionnary directly to bytes, with the same 2-space layout as json.dump(indent=2);
+# the combo codes are integer keys, which OPT_NON_STR_KEYS writes as strings like the json module does
+with open(output_file, 'wb') as f:
+    f.write(orjson.dumps(ratio_dict, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
 print(f"\nDictionary exported to {output_file}")
 
@@ -358,17 +365,19 @@ with rasterio.open(raster_path) as src:
     profile = src.profile
 
 # Create UNIQUE_ID attribute in intersected_gdf using the dictionary
-intersected_gdf['UNIQUE_ID'] = intersected_gdf.apply(
-    lambda row: comboCodes_dict[row['JURIS_ID']][row['ECOZONE_ID']], 
-    axis=1
-)
+# (flattened to (province, ecozone) keys, to map all of the polygons at once instead of row by row)
+flat_comboCodes = {(juris, ecozone): code for juris, codes in comboCodes_dict.items() for ecozone, code in codes.items()}
+combo_keys = pd.Series(list(zip(intersected_gdf['JURIS_ID'], intersected_gdf['ECOZONE_ID'].astype(int))),
+                       index=intersected_gdf.index)
+intersected_gdf['UNIQUE_ID'] = combo_keys.map(flat_comboCodes).astype(np.uint16)
 
 # Ensure the GeoDataFrame has the same CRS as the raster
 if intersected_gdf.crs != crs:
     intersected_gdf = intersected_gdf.to_crs(crs)
 
-# Create list of (geometry, value) pairs for rasterization
-shapes = [(geom, value) for geom, value in zip(intersected_gdf.geometry, intersected_gdf['UNIQUE_ID'])]
+# Create list of (geometry, value) pairs for rasterization, skipping missing or empty geometries
+shapes = [(geom, int(value)) for geom, value in zip(intersected_gdf.geometry.to_numpy(), intersected_gdf['UNIQUE_ID'].to_numpy())
+          if geom is not None and not geom.is_empty]
 
 # Burn the UNIQUE_ID values into a new raster
 burned_raster = rasterize(
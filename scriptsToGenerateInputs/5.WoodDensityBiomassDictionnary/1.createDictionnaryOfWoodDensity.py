@@ -11,36 +11,40 @@ def download_file(url, filename):
     urllib.request.urlretrieve(url, filename)
     print(f"Downloaded {filename}")
 
-def read_tsv(filename):
-    """Read tab-separated file into list of dictionaries"""
+def read_tsv_columns(filename, columns):
+    """Read only the given columns of a tab-separated file into a list of tuples, one per row.
+    The columns are taken by their index in the header, without building a dictionary for each row.
+    A column absent from the header is read as '', a field missing from a short row as None."""
     with open(filename, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        return list(reader)
+        reader = csv.reader(f, delimiter='\t')
+        header_indexes = {name: index for index, name in enumerate(next(reader, []))}
+        indexes = [header_indexes.get(column) for column in columns]
+        return [tuple(('' if index is None else row[index] if index < len(row) else None) for index in indexes)
+                for row in reader if row]
 
 def merge_wood_density_data():
     """Merge measurements and occurrences data"""
     print("Merging wood density data...")
 
-    measurements = read_tsv('measurements or facts.txt')
-    occurrences = read_tsv('occurrences.txt')
+    measurements = read_tsv_columns('measurements or facts.txt', ['Occurrence ID', 'Measurement Value'])
+    occurrences = read_tsv_columns('occurrences.txt', ['OccurrenceID', 'TaxonID', 'Locality'])
 
     # Create lookup dictionary for occurrences
-    occ_dict = {row['OccurrenceID']: row for row in occurrences}
+    occ_dict = {occ_id: (taxon_id, locality) for occ_id, taxon_id, locality in occurrences}
 
     # Merge data
     wood_density_data = []
-    for meas in measurements:
-        occ_id = meas.get('Occurrence ID', '')
-        occ = occ_dict.get(occ_id, {})
+    for occ_id, value in measurements:
+        taxon_id, locality = occ_dict.get(occ_id, ('', ''))
 
         try:
-            density_value = float(meas.get('Measurement Value', ''))
+            density_value = float(value)
         except (ValueError, TypeError):
             continue
 
         wood_density_data.append({
-            'SpeciesName': occ.get('TaxonID', ''),
-            'WorldRegion': occ.get('Locality', ''),
+            'SpeciesName': taxon_id,
+            'WorldRegion': locality,
             'WoodDensity_MetricTons_per_m3': density_value
         })
 
@@ -49,24 +53,30 @@ def merge_wood_density_data():
 
     return wood_density_data
 
-def match_species(abbreviated, full_name):
-    """Match abbreviated species name (PINU.BAN) with full name (Pinus banksiana)"""
+def build_species_index(wood_density_data):
+    """Index the wood density rows by the prefixes of their full name (Pinus banksiana) that abbreviated
+    names (PINU.BAN) are matched against : up to 4 letters of genus and up to 3 letters of species.
+    For each prefix, the first row in the data is kept."""
+    species_index = {}
+    for wd_row in wood_density_data:
+        full_parts = wd_row['SpeciesName'].split()
+        if len(full_parts) < 2:
+            continue
+        genus_full, species_full = full_parts[0].upper(), full_parts[1].upper()
+        # Abbreviations shorter than 4 (genus) or 3 (species) letters match on shorter prefixes
+        for genus_length in range(5):
+            for species_length in range(4):
+                species_index.setdefault((genus_full[:genus_length], species_full[:species_length]), wd_row)
+    return species_index
+
+def species_key(abbreviated):
+    """Key of an abbreviated species name (PINU.BAN) in the species index : the first 4 letters
+    of its genus and the first 3 letters of its species, uppercased. None if it is not a genus.species name."""
     parts = abbreviated.split('.')
     if len(parts) != 2:
-        return False
-
-    genus_abbr, species_abbr = parts[0].upper(), parts[1].upper()
-    full_parts = full_name.split()
-
-    if len(full_parts) < 2:
-        return False
+        return None
 
-    genus_full = full_parts[0].upper()
-    species_full = full_parts[1].upper()
-
-    # Match first 4 letters of genus and first 3 letters of species
-    return (genus_full.startswith(genus_abbr[:4]) and 
-            species_full.startswith(species_abbr[:3]))
+    return (parts[0].upper()[:4], parts[1].upper()[:3])
 
 def main():
     # Step 1: Download and extract wood density database
@@ -106,20 +116,20 @@ def main():
     wood_density_dict = {}
     not_found = []
 
-    for nfi_sp in sorted(nfi_species):
-        matched = False
-
-        for wd_row in wood_density_data:
-            if match_species(nfi_sp, wd_row['SpeciesName']):
-                wood_density_dict[nfi_sp] = {
-                    "wood_density_value": wd_row['WoodDensity_MetricTons_per_m3'],
-                    "unit": "oven dry mass/fresh volume as metricTons per m3",
-                    "species_full_name": wd_row['SpeciesName']
-                }
-                matched = True
-                break
-
-        if not matched:
+    # The lookup keys of the NFI species are computed once, in the order of the dictionnary
+    species_index = build_species_index(wood_density_data)
+    nfi_keys = [(nfi_sp, species_key(nfi_sp)) for nfi_sp in sorted(nfi_species)]
+    for nfi_sp, key in nfi_keys:
+        # Match first 4 letters of genus and first 3 letters of species
+        wd_row = species_index.get(key) if key is not None else None
+
+        if wd_row is not None:
+            wood_density_dict[nfi_sp] = {
+                "wood_density_value": wd_row['WoodDensity_MetricTons_per_m3'],
+                "unit": "oven dry mass/fresh volume as metricTons per m3",
+                "species_full_name": wd_row['SpeciesName']
+            }
+        else:
             not_found.append(nfi_sp)
             print(f"No match found for: {nfi_sp}")
 
@@ -3,6 +3,10 @@ import os
 import glob
 import re
 import csv
+from itertools import filterfalse
+
+# Format of the species codes (XXXX.YYY)
+SPECIES_CODE_PATTERN = re.compile(r'^[A-Z]{4}\.[A-Z]{3}$')
 
 def readJSONDictionnary(path):
     """
@@ -53,17 +57,13 @@ def main():
     csv_path = csv_files[0]
 
     # Read CSV and extract first column
-    species_codes = []
     with open(csv_path, 'r') as f:
         reader = csv.reader(f)
         next(reader)  # Skip header if present
-        for row in reader:
-            if row:  # Skip empty rows
-                species_codes.append(row[0])
+        species_codes = [row[0] for row in reader if row]  # Skip empty rows
 
-    # Check species code format (XXXX.YYY)
-    species_pattern = re.compile(r'^[A-Z]{4}\.[A-Z]{3}$')
-    invalid_codes = [code for code in species_codes if not species_pattern.match(code)]
+    # Check species code format (XXXX.YYY), with the precompiled pattern applied to all codes in a single pass
+    invalid_codes = list(filterfalse(SPECIES_CODE_PATTERN.match, species_codes))
 
     if invalid_codes:
         print("    MHS-CBAU :  Error: Invalid species code format detected.")
@@ -74,11 +74,11 @@ def main():
         return
 
     # Check if species exist in JSON files
-    unique_species = list(set(species_codes))
+    # (deduplicated in the order of the CSV, and looked up directly in the dictionnaries)
+    unique_species = list(dict.fromkeys(species_codes))
 
     for json_filename, json_dict in json_files.items():
-        json_keys = set(json_dict.keys())
-        missing_species = [species for species in unique_species if species not in json_keys]
+        missing_species = list(filterfalse(json_dict.__contains__, unique_species))
 
         if missing_species:
             for species in missing_species: